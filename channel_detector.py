@@ -15,6 +15,525 @@ PHẦN 1: CẤU TRÚC CƠ BẢN + QUẢN LÝ DỮ LIỆU
 - Xóa điểm cũ khi vượt quá giới hạn
 """
 
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    # Không có numba: njit không làm gì, kernel chạy như hàm Python thường
+    NUMBA_AVAILABLE = False
+    
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+    
+    prange = range
+
+
+def _to_ms(ts):
+    """
+    Chuyển timestamp (int/float ms hoặc chuỗi ngày giờ) sang milliseconds
+    
+    Trả về 0 nếu không parse được (giữ hành vi cũ của to_ms)
+    """
+    if isinstance(ts, (int, float, np.integer, np.floating)):
+        return int(ts)
+    try:
+        return int(pd.to_datetime(ts).timestamp() * 1000)
+    except:
+        return 0
+
+
+def _to_ms_array(values):
+    """
+    Bản vector hóa của _to_ms cho cả cột timestamp
+    
+    - Cột số (ms) → ép kiểu int64
+    - Cột chuỗi ngày giờ → pd.to_datetime 1 lần cho cả cột
+    - Parse lỗi → quay về _to_ms từng phần tử (giữ hành vi trả 0)
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'iuf':
+        return values.astype(np.int64)
+    try:
+        if len(values) > 0 and isinstance(values[0], (int, float, np.integer, np.floating)):
+            # Cột object chứa số (ms)
+            return pd.to_numeric(values).astype(np.int64)
+        dt = pd.DatetimeIndex(pd.to_datetime(values))
+        if dt.tz is not None:
+            dt = dt.tz_convert(None)  # Về UTC (như Timestamp.timestamp())
+        return dt.to_numpy().astype('datetime64[ms]').astype(np.int64)
+    except (ValueError, TypeError):
+        return np.fromiter((_to_ms(ts) for ts in values), dtype=np.int64, count=len(values))
+
+
+# Số nến mỗi bucket của CandleBuffer (max high / min low theo bucket để lọc nhanh)
+_BUCKET_SIZE = 32
+
+
+@njit(cache=True, fastmath=True, boundscheck=False)
+def _pen_upper(cts, chigh, hmax, base, s, e, slope, intercept, max_count):
+    """
+    Penetration của đường trên: nến có high vượt lên trên đường
+    
+    Duyệt theo bucket: đường là tuyến tính nên giá thấp nhất của đường trong đoạn
+    nằm ở 1 trong 2 đầu → nếu max high của bucket không vượt giá đó thì
+    không nến nào trong đoạn phá đường, bỏ qua cả đoạn
+    
+    Trong bucket không rẽ nhánh theo từng nến: count += (d > 0), max_pct lấy max
+    (nến không phá có pct <= 0 nên không ảnh hưởng) → numba vector hóa được;
+    kiểm tra dừng sớm sau mỗi bucket
+    """
+    count = 0
+    max_pct = 0.0
+    i = s
+    while i < e:
+        b = (base + i) // _BUCKET_SIZE
+        stop = min((b + 1) * _BUCKET_SIZE - base, e)
+        lowest = min(slope * cts[i] + intercept, slope * cts[stop - 1] + intercept)
+        if hmax[b] > lowest:
+            for k in range(i, stop):
+                line_price = slope * cts[k] + intercept
+                d = chigh[k] - line_price
+                count += d > 0
+                max_pct = max(max_pct, d / line_price * 100)
+            if count > max_count:
+                return count, -1.0
+        i = stop
+    return count, max_pct
+
+
+@njit(cache=True, fastmath=True, boundscheck=False)
+def _pen_lower(cts, clow, lmin, base, s, e, slope, intercept, max_count):
+    """
+    Penetration của đường dưới: nến có low thủng xuống dưới đường
+    
+    Bỏ qua cả bucket nếu min low của bucket không thấp hơn giá cao nhất của đường trong đoạn
+    """
+    count = 0
+    max_pct = 0.0
+    i = s
+    while i < e:
+        b = (base + i) // _BUCKET_SIZE
+        stop = min((b + 1) * _BUCKET_SIZE - base, e)
+        highest = max(slope * cts[i] + intercept, slope * cts[stop - 1] + intercept)
+        if lmin[b] < highest:
+            for k in range(i, stop):
+                line_price = slope * cts[k] + intercept
+                d = line_price - clow[k]
+                count += d > 0
+                max_pct = max(max_pct, d / line_price * 100)
+            if count > max_count:
+                return count, -1.0
+        i = stop
+    return count, max_pct
+
+
+@njit(cache=True, boundscheck=False)
+def _penetration_kernel(cts, chigh, clow, hmax, lmin, base, s, e,
+                        slope, intercept, is_upper, max_count):
+    """
+    Đếm số nến phá qua đường trong khoảng nến [s, e) và % phá lớn nhất
+    
+    Rẽ nhánh upper/lower 1 lần rồi gọi vòng lặp riêng cho từng loại
+    (_pen_upper/_pen_lower) → trong vòng lặp không còn if is_upper
+    
+    hmax, lmin, base: max high / min low theo bucket của CandleBuffer,
+    base = head (chỉ số nến 0 trong mảng gốc)
+    
+    RETURN:
+    -------
+    (count, max_pct)
+        Dừng sớm khi count > max_count (lúc đó max_pct = -1.0)
+    """
+    if is_upper:
+        return _pen_upper(cts, chigh, hmax, base, s, e, slope, intercept, max_count)
+    return _pen_lower(cts, clow, lmin, base, s, e, slope, intercept, max_count)
+
+
+def _penetration_numpy(cts, chigh, clow, hmax, lmin, base, s, e,
+                       slope, intercept, is_upper, max_count):
+    """
+    Bản NumPy của _penetration_kernel (dùng khi không có numba)
+    
+    Tính vector hóa trên cả đoạn nên không dùng bucket (hmax, lmin, base)
+    """
+    # Giá của đường tại thời điểm từng nến: line_price = slope * timestamp + intercept
+    line_price = slope * cts[s:e].astype(np.float64) + intercept
+    
+    # Độ phá của từng nến (> 0 là phá qua đường)
+    if is_upper:
+        # Đường trên: high vượt qua đường
+        diff = chigh[s:e] - line_price
+    else:
+        # Đường dưới: low thủng xuống dưới đường
+        diff = line_price - clow[s:e]
+    
+    mask = diff > 0
+    count = int(np.count_nonzero(mask))
+    if count > max_count:
+        return count, -1.0
+    if count == 0:
+        return 0, 0.0
+    return count, float(np.max(diff[mask] / line_price[mask] * 100))
+
+
+@njit(cache=True, boundscheck=False, nogil=True)
+def _penetration_batch_kernel(cts, chigh, clow, hmax, lmin, base, n, scan_from, end_ts,
+                              slopes, intercepts, is_upper, max_counts):
+    """
+    Penetration cho NHIỀU đường trong 1 lần gọi (toàn bộ vòng lặp chạy trong code đã biên dịch)
+    
+    Đường thứ j xét các nến có scan_from[j] < ts < end_ts[j]
+    
+    RETURN:
+    -------
+    (counts, max_pcts): 2 mảng, phần tử j như _penetration_kernel của đường j
+    """
+    m = len(slopes)
+    counts = np.zeros(m, dtype=np.int64)
+    max_pcts = np.zeros(m, dtype=np.float64)
+    ts = cts[:n]
+    for j in range(m):
+        s = np.searchsorted(ts, scan_from[j], side='right')
+        e = np.searchsorted(ts, end_ts[j], side='left')
+        if e > s:
+            counts[j], max_pcts[j] = _penetration_kernel(
+                cts, chigh, clow, hmax, lmin, base, s, e,
+                slopes[j], intercepts[j], is_upper[j], max_counts[j])
+    return counts, max_pcts
+
+
+@njit(cache=True, boundscheck=False, nogil=True, parallel=True)
+def _penetration_batch_parallel(cts, chigh, clow, hmax, lmin, base, n, scan_from, end_ts,
+                                slopes, intercepts, is_upper, max_counts):
+    """
+    Như _penetration_batch_kernel nhưng chia các đường cho nhiều luồng (prange)
+    
+    Chỉ đáng dùng khi có nhiều đường (xem _PARALLEL_MIN_LINES): khởi động
+    luồng tốn thời gian hơn cả việc quét vài đường
+    """
+    m = len(slopes)
+    counts = np.zeros(m, dtype=np.int64)
+    max_pcts = np.zeros(m, dtype=np.float64)
+    ts = cts[:n]
+    for j in prange(m):
+        s = np.searchsorted(ts, scan_from[j], side='right')
+        e = np.searchsorted(ts, end_ts[j], side='left')
+        if e > s:
+            c, p = _penetration_kernel(
+                cts, chigh, clow, hmax, lmin, base, s, e,
+                slopes[j], intercepts[j], is_upper[j], max_counts[j])
+            counts[j] = c
+            max_pcts[j] = p
+    return counts, max_pcts
+
+
+# Số đường tối thiểu để dùng bản song song
+_PARALLEL_MIN_LINES = 64
+
+
+# Số phần tử tối đa của ma trận [số đường, số nến] mỗi lần tính trong
+# _penetration_batch_numpy (~8 MB cho mỗi mảng float64 tạm)
+_BATCH_NUMPY_MAX_CELLS = 1 << 20
+
+
+def _penetration_batch_numpy(cts, chigh, clow, hmax, lmin, base, n, scan_from, end_ts,
+                             slopes, intercepts, is_upper, max_counts):
+    """
+    Bản NumPy của _penetration_batch_kernel (dùng khi không có numba)
+    
+    Xếp đường theo nến bắt đầu rồi chia thành nhóm liên tiếp sao cho
+    số đường * khoảng nến chung của nhóm <= _BATCH_NUMPY_MAX_CELLS.
+    Mỗi nhóm tính bằng ma trận 2D [số đường, số nến] (_penetration_group_numpy)
+    → bộ nhớ bị chặn, không tăng theo (tổng số đường * toàn bộ lịch sử nến)
+    """
+    m = len(slopes)
+    counts = np.zeros(m, dtype=np.int64)
+    max_pcts = np.zeros(m, dtype=np.float64)
+    if m == 0:
+        return counts, max_pcts
+    ts = cts[:n]
+    starts = np.searchsorted(ts, scan_from, side='right')
+    ends = np.searchsorted(ts, end_ts, side='left')
+    
+    order = np.argsort(starts, kind='stable')
+    sorted_starts = starts[order].tolist()
+    sorted_ends = ends[order].tolist()
+    j = 0
+    while j < m:
+        # Nhóm bắt đầu từ đường j (nến bắt đầu nhỏ nhất nhóm), thêm đường đến khi vượt ngân sách
+        lo = sorted_starts[j]
+        hi = sorted_ends[j]
+        k = j + 1
+        while k < m:
+            new_hi = max(hi, sorted_ends[k])
+            if (k + 1 - j) * (new_hi - lo) > _BATCH_NUMPY_MAX_CELLS:
+                break
+            hi = new_hi
+            k += 1
+        if hi > lo and k == j + 1:
+            # Nhóm 1 đường → không cần ma trận 2D
+            i = order[j]
+            counts[i], max_pcts[i] = _penetration_numpy(
+                cts, chigh, clow, hmax, lmin, base, lo, hi,
+                slopes[i], intercepts[i], is_upper[i], max_counts[i])
+        elif hi > lo:
+            group = order[j:k]
+            counts[group], max_pcts[group] = _penetration_group_numpy(
+                cts, chigh, clow, lo, hi, starts[group], ends[group],
+                slopes[group], intercepts[group], is_upper[group], max_counts[group])
+        j = k
+    return counts, max_pcts
+
+
+def _penetration_group_numpy(cts, chigh, clow, lo, hi, starts, ends,
+                             slopes, intercepts, is_upper, max_counts):
+    """
+    Penetration của 1 nhóm đường trên khoảng nến chung [lo, hi)
+    
+    Ma trận 2D [số đường, hi - lo], mỗi hàng chỉ tính các nến trong [s_j, e_j) của đường đó
+    """
+    # Giá của từng đường tại từng nến: [m, hi - lo]
+    t = cts[lo:hi].astype(np.float64)
+    line_price = slopes[:, None] * t[None, :] + intercepts[:, None]
+    
+    # Độ phá: đường trên dùng high, đường dưới dùng low
+    diff = np.where(is_upper[:, None],
+                    chigh[lo:hi][None, :] - line_price,
+                    line_price - clow[lo:hi][None, :])
+    
+    # Chỉ tính nến nằm trong khoảng riêng của từng đường
+    idx = np.arange(lo, hi)
+    in_range = (idx[None, :] >= starts[:, None]) & (idx[None, :] < ends[:, None])
+    mask = (diff > 0) & in_range
+    counts = np.count_nonzero(mask, axis=1).astype(np.int64)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = np.where(mask, diff / line_price * 100, -np.inf)
+    max_pcts = pct.max(axis=1)
+    max_pcts[counts == 0] = 0.0
+    max_pcts[counts > max_counts] = -1.0
+    return counts, max_pcts
+
+
+# Chọn bản nhanh nhất có sẵn
+if NUMBA_AVAILABLE:
+    _penetration_batch = _penetration_batch_kernel
+else:
+    _penetration_batch = _penetration_batch_numpy
+
+
+# Mã lý do loại đường (đổi ra chuỗi khi cần, xem ChannelDetector._reason_text)
+REASON_OK = 0
+REASON_SLOPE = 1          # Độ dốc quá lớn
+REASON_DISTANCE = 2       # 2 điểm quá gần
+REASON_PEN_COUNT = 3      # Quá nhiều nến phá
+REASON_PEN_PCT = 4        # Nến phá quá mạnh
+
+
+@dataclass(slots=True)
+class Pivot:
+    """
+    Điểm đỉnh/đáy đã nhận từ ZigZag
+    """
+    id: int
+    ts: int          # Timestamp (ms)
+    price: float
+    is_peak: bool    # True = đỉnh, False = đáy
+    
+    @property
+    def type(self):
+        return 'peak' if self.is_peak else 'trough'
+
+
+@dataclass(slots=True)
+class Line:
+    """
+    Đường thẳng y = slope * ts + intercept nối 2 pivot cùng loại
+    """
+    id: str                  # 'line_{id1}_{id2}'
+    point1_id: int
+    point2_id: int
+    ts1: int                 # Timestamp (ms) của 2 điểm
+    ts2: int
+    price1: float            # Giá của 2 điểm
+    price2: float
+    slope: float             # Độ dốc (a)
+    intercept: float         # Điểm cắt (b)
+    is_upper: bool           # True = đường trên (đỉnh-đỉnh), False = đường dưới
+    # Cache penetration: kết quả đã tính cho các nến có ts <= validated_until
+    validated_until: float = float('-inf')  # Timestamp nến cuối đã kiểm tra
+    pen_count: int = 0                      # Số nến phá đã đếm
+    pen_max_pct: float = 0.0                # % phá lớn nhất đã gặp
+    point_ids: tuple = field(init=False)    # (point1_id, point2_id), tạo 1 lần
+    
+    def __post_init__(self):
+        self.point_ids = (self.point1_id, self.point2_id)
+    
+    @property
+    def type(self):
+        return 'upper' if self.is_upper else 'lower'
+
+
+class CandleBuffer:
+    """
+    Lưu trữ nến dạng cột (SoA): mỗi trường là 1 mảng NumPy
+    
+    - ts: timestamp (ms, int64)
+    - o, h, l, c, v: open/high/low/close/volume (float64)
+    - n: số nến thực tế (chỉ [:n] là dữ liệu thật)
+    - cap: dung lượng đã cấp phát
+    
+    Nến được thêm theo thứ tự thời gian → ts[:n] luôn tăng dần
+    (dùng tìm kiếm nhị phân được)
+    
+    Bên trong: mảng gốc _ts, _o, ... và chỉ số head (nến đầu tiên còn giữ).
+    ts, o, h, l, c, v là view bắt đầu từ head → xóa nến đầu chỉ tăng head (O(1)),
+    dữ liệu chỉ được dồn về đầu mảng khi hết chỗ ở cuối.
+    
+    Bucket (_BUCKET_SIZE nến liên tiếp theo chỉ số mảng gốc):
+    - hmax[b]: max high, lmin[b]: min low của bucket b (cập nhật khi thêm nến)
+    - Nến bị xóa ở đầu vẫn có thể còn tính trong bucket → chỉ làm bucket
+      "rộng" hơn thực tế, kernel penetration vẫn đúng (chỉ bỏ qua ít bucket hơn)
+    """
+    __slots__ = ('_ts', '_o', '_h', '_l', '_c', '_v',
+                 'ts', 'o', 'h', 'l', 'c', 'v', 'hmax', 'lmin', 'head', 'n', 'cap')
+    
+    def __init__(self, cap=64):
+        self._ts = np.empty(cap, dtype=np.int64)
+        self._o = np.empty(cap, dtype=np.float64)
+        self._h = np.empty(cap, dtype=np.float64)
+        self._l = np.empty(cap, dtype=np.float64)
+        self._c = np.empty(cap, dtype=np.float64)
+        self._v = np.empty(cap, dtype=np.float64)
+        self.hmax = np.full(cap // _BUCKET_SIZE + 1, -np.inf)
+        self.lmin = np.full(cap // _BUCKET_SIZE + 1, np.inf)
+        self.head = 0
+        self.n = 0
+        self.cap = cap
+        self._update_views()
+    
+    def __len__(self):
+        return self.n
+    
+    def _update_views(self):
+        """Tạo lại các view ts, o, h, l, c, v bắt đầu từ head"""
+        head = self.head
+        self.ts = self._ts[head:]
+        self.o = self._o[head:]
+        self.h = self._h[head:]
+        self.l = self._l[head:]
+        self.c = self._c[head:]
+        self.v = self._v[head:]
+    
+    def _update_buckets(self, pos):
+        """Tính lại hmax/lmin cho các bucket từ vị trí pos (mảng gốc) đến nến cuối"""
+        end = self.head + self.n
+        if end <= pos:
+            return
+        b0 = pos // _BUCKET_SIZE
+        b1 = (end - 1) // _BUCKET_SIZE
+        start = max(b0 * _BUCKET_SIZE, self.head)
+        offsets = np.arange(b0, b1 + 1) * _BUCKET_SIZE - start
+        offsets[0] = 0
+        self.hmax[b0:b1 + 1] = np.maximum.reduceat(self._h[start:end], offsets)
+        self.lmin[b0:b1 + 1] = np.minimum.reduceat(self._l[start:end], offsets)
+    
+    def ensure(self, cap):
+        """
+        Đảm bảo đủ chỗ cho cap nến tính từ head
+        
+        - Nếu phần trống ở đầu (trước head) đã chiếm >= nửa mảng → dồn dữ liệu về đầu
+        - Ngược lại → cấp phát mảng mới gấp đôi (tăng trưởng hình học), chỉ chép phần đang dùng
+        """
+        if self.head + cap <= self.cap:
+            return
+        head = self.head
+        n = self.n
+        if cap <= self.cap and head >= self.cap // 2:
+            # Dồn về đầu mảng (không cấp phát)
+            for arr in (self._ts, self._o, self._h, self._l, self._c, self._v):
+                arr[:n] = arr[head:head + n]
+        else:
+            new_cap = max(cap, 2 * self.cap)
+            for name in ('_ts', '_o', '_h', '_l', '_c', '_v'):
+                old = getattr(self, name)
+                new = np.empty(new_cap, dtype=old.dtype)
+                new[:n] = old[head:head + n]
+                setattr(self, name, new)
+            self.cap = new_cap
+            self.hmax = np.empty(new_cap // _BUCKET_SIZE + 1)
+            self.lmin = np.empty(new_cap // _BUCKET_SIZE + 1)
+        self.head = 0
+        self._update_views()
+        # Vị trí nến đã đổi → tính lại toàn bộ bucket
+        self.hmax.fill(-np.inf)
+        self.lmin.fill(np.inf)
+        self._update_buckets(0)
+    
+    def extend(self, ts, o, h, l, c, v):
+        """Thêm nhiều nến vào cuối (mỗi tham số là 1 mảng cùng độ dài)"""
+        n = self.n
+        k = len(ts)
+        self.ensure(n + k)
+        self.ts[n:n + k] = ts
+        self.o[n:n + k] = o
+        self.h[n:n + k] = h
+        self.l[n:n + k] = l
+        self.c[n:n + k] = c
+        self.v[n:n + k] = v
+        self.n = n + k
+        self._update_buckets(self.head + n)
+    
+    def append(self, ts, o, h, l, c, v):
+        """Thêm 1 nến vào cuối"""
+        n = self.n
+        self.ensure(n + 1)
+        self.ts[n] = ts
+        self.o[n] = o
+        self.h[n] = h
+        self.l[n] = l
+        self.c[n] = c
+        self.v[n] = v
+        self.n = n + 1
+        b = (self.head + n) // _BUCKET_SIZE
+        if h > self.hmax[b]:
+            self.hmax[b] = h
+        if l < self.lmin[b]:
+            self.lmin[b] = l
+    
+    def drop_before(self, ts):
+        """
+        Xóa các nến có timestamp < ts
+        
+        RETURN:
+        -------
+        Số nến đã xóa
+        """
+        k = int(np.searchsorted(self.ts[:self.n], ts, side='left'))
+        if k > 0:
+            # Chỉ dời head, không chép dữ liệu
+            self.head += k
+            self.n -= k
+            self._update_views()
+        return k
+    
+    def clear(self):
+        """Xóa toàn bộ nến (giữ lại bộ nhớ đã cấp phát)"""
+        self.head = 0
+        self.n = 0
+        self._update_views()
+        self.hmax.fill(-np.inf)
+        self.lmin.fill(np.inf)
+
 
 class ChannelDetector:
     """
@@ -23,7 +542,8 @@ class ChannelDetector:
     
     def __init__(self, max_pivots=10, max_age_ms=None, H=5000, point=0.1,
                  max_slope=None, min_distance_candles=3,
-                 max_penetration_pct=0.3, max_penetrating_candles=2):
+                 max_penetration_pct=0.3, max_penetrating_candles=2,
+                 verbose=False):
         """
         Khởi tạo ChannelDetector
         
@@ -63,8 +583,13 @@ class ChannelDetector:
         max_penetrating_candles: int
             Số nến phá qua tối đa cho phép (ví dụ: 2)
             Nếu có > 2 nến phá qua → Loại đường
+            
+        verbose: bool
+            True = in log chi tiết từng bước (thêm điểm, tạo/loại đường, ...)
+            Mặc định False: khi backtest hàng trăm nghìn nến, print chiếm phần lớn thời gian
         """
         # ===== THAM SỐ CẤU HÌNH =====
+        self.verbose = verbose
         self.max_pivots = max_pivots
         self.max_age_ms = max_age_ms
         self.H = H
@@ -73,7 +598,7 @@ class ChannelDetector:
         
         # Tham số validation (PHẦN 3)
         self.max_slope = max_slope
-        self.min_distance_candles = min_distance_candles
+        self._min_distance_candles = min_distance_candles
         
         # Tham số penetration analysis
         self.max_penetration_pct = max_penetration_pct
@@ -81,14 +606,17 @@ class ChannelDetector:
         
         # Ước lượng khoảng cách 1 nến (milliseconds)
         # Giả định timeframe trung bình là 15 phút = 900000 ms
-        self.candle_interval_ms = 15 * 60 * 1000
+        self._candle_interval_ms = 15 * 60 * 1000
+        self._update_distance_threshold()
         
         # ===== LƯU TRỮ ĐIỂM ĐỈNH/ĐÁY =====
-        self.peaks_list = []      # Danh sách các đỉnh: [{timestamp, price, index_id}, ...]
-        self.troughs_list = []    # Danh sách các đáy: [{timestamp, price, index_id}, ...]
+        # deque: xóa điểm cũ nhất (đầu danh sách) O(1) bằng popleft
+        self.peaks_list = deque()      # Danh sách các đỉnh: [Pivot, ...]
+        self.troughs_list = deque()    # Danh sách các đáy: [Pivot, ...]
         
         # ===== LƯU TRỮ CANDLES (SLIDING WINDOW) =====
-        self.candles_list = []    # Danh sách các nến: [{timestamp, open, high, low, close, volume}, ...]
+        # Lưu dạng cột (CandleBuffer), timestamp đã chuyển sang ms khi nhận nến
+        self.candles = CandleBuffer()
         
         # index_id để đánh số thứ tự điểm (tăng dần, không bao giờ reset)
         # Dùng để tránh tạo lại đường cũ
@@ -105,10 +633,42 @@ class ChannelDetector:
         self.created_line_pairs = set()  # Set các cặp (id1, id2) đã tạo đường
         self.created_combinations = set()  # Set các cặp (upper_id, lower_id) đã tạo tổ hợp
         
-        print(f"✓ Khởi tạo ChannelDetector: max_pivots={max_pivots}, "
-              f"max_age_ms={max_age_ms}, H={H}, point={point}, dH={self.dH}")
-        print(f"  Validation: max_slope={max_slope}, min_distance_candles={min_distance_candles}")
-        print(f"  Penetration: max_pct={max_penetration_pct}%, max_candles={max_penetrating_candles}")
+        if self.verbose:
+            print(f"✓ Khởi tạo ChannelDetector: max_pivots={max_pivots}, "
+                  f"max_age_ms={max_age_ms}, H={H}, point={point}, dH={self.dH}")
+            print(f"  Validation: max_slope={max_slope}, min_distance_candles={min_distance_candles}")
+            print(f"  Penetration: max_pct={max_penetration_pct}%, max_candles={max_penetrating_candles}")
+    
+    
+    @property
+    def min_distance_candles(self):
+        """Số nến tối thiểu giữa 2 điểm tạo đường (gán lại → tính lại ngưỡng ms)"""
+        return self._min_distance_candles
+    
+    @min_distance_candles.setter
+    def min_distance_candles(self, value):
+        self._min_distance_candles = value
+        self._update_distance_threshold()
+    
+    @property
+    def candle_interval_ms(self):
+        """Khoảng cách 1 nến (ms) (gán lại → tính lại ngưỡng ms)"""
+        return self._candle_interval_ms
+    
+    @candle_interval_ms.setter
+    def candle_interval_ms(self, value):
+        self._candle_interval_ms = value
+        self._update_distance_threshold()
+    
+    def _update_distance_threshold(self):
+        """
+        Tính sẵn nghịch đảo khoảng cách nến (nhân thay vì chia) và ngưỡng khoảng cách (ms)
+        
+        So sánh trực tiếp bằng ms → chính xác tuyệt đối, không lệch do làm tròn float.
+        Gọi lại mỗi khi min_distance_candles / candle_interval_ms đổi
+        """
+        self._inv_candle_interval_ms = 1.0 / self._candle_interval_ms
+        self._min_distance_ms = self._min_distance_candles * self._candle_interval_ms
     
     
     def add_pivot(self, zigzag_output):
@@ -128,7 +688,7 @@ class ChannelDetector:
                     'volume': 1234
                 },
                 'pivot': {
-                    'timestamp': 1731758700000,  # Unix timestamp (milliseconds)
+                    'timestamp': 1731758700000,  # Unix timestamp (milliseconds) hoặc chuỗi ngày giờ
                     'price': 95000.5,
                     'type': 'peak'  # hoặc 'trough'
                 } hoặc None
@@ -154,7 +714,7 @@ class ChannelDetector:
         
         # Luôn lưu candle vào sliding window (dù có pivot hay không)
         if candle:
-            self.candles_list.append(candle)
+            self.add_candle(candle)
         
         # Nếu không có pivot, bỏ qua phần xử lý pivot
         if pivot is None:
@@ -164,23 +724,21 @@ class ChannelDetector:
         self._next_pivot_id += 1
         
         # Tạo điểm với đầy đủ thông tin
-        pivot_full = {
-            'id': pivot_id,
-            'timestamp': pivot['timestamp'],
-            'price': pivot['price'],
-            'type': pivot['type']
-        }
+        # Timestamp chuẩn hóa sang ms MỘT LẦN ở đây, các bước sau dùng trực tiếp
+        pivot_full = Pivot(pivot_id, _to_ms(pivot['timestamp']), pivot['price'],
+                           pivot['type'] == 'peak')
         
         # Phân loại và thêm vào danh sách tương ứng
-        if pivot['type'] == 'peak':
+        if pivot_full.is_peak:
             self.peaks_list.append(pivot_full)
             list_name = 'đỉnh'
         else:  # trough
             self.troughs_list.append(pivot_full)
             list_name = 'đáy'
         
-        print(f"  → Thêm {list_name} #{pivot_id}: "
-              f"Price={pivot['price']}, Timestamp={pivot['timestamp']}")
+        if self.verbose:
+            print(f"  → Thêm {list_name} #{pivot_id}: "
+                  f"Price={pivot['price']}, Timestamp={pivot['timestamp']}")
         
         # Xóa điểm cũ nếu cần
         self._cleanup_old_pivots()
@@ -191,6 +749,44 @@ class ChannelDetector:
         return pivot_id
     
     
+    def add_candle(self, candle):
+        """
+        Thêm 1 nến vào sliding window (CandleBuffer)
+        
+        INPUT:
+        ------
+        candle: dict
+            {timestamp, open, high, low, close, volume}
+        
+        LƯU Ý:
+        ------
+        Nến phải được thêm theo thứ tự thời gian tăng dần
+        (penetration analysis dùng tìm kiếm nhị phân trên timestamp)
+        """
+        self.candles.append(_to_ms(candle['timestamp']), candle['open'], candle['high'],
+                            candle['low'], candle['close'], candle['volume'])
+    
+    
+    def add_candles(self, df):
+        """
+        Thêm nhiều nến 1 lần từ DataFrame (thay cho vòng lặp add_candle)
+        
+        INPUT:
+        ------
+        df: pd.DataFrame
+            Các cột timestamp, open, high, low, close, volume
+            (xếp theo thời gian tăng dần, tiếp nối các nến đã có)
+        
+        XỬ LÝ:
+        ------
+        Chuyển timestamp cả cột sang ms 1 lần rồi chép thẳng các cột vào CandleBuffer
+        """
+        self.candles.extend(_to_ms_array(df['timestamp'].to_numpy()),
+                            df['open'].to_numpy(), df['high'].to_numpy(),
+                            df['low'].to_numpy(), df['close'].to_numpy(),
+                            df['volume'].to_numpy())
+    
+    
     def _cleanup_old_pivots(self):
         """
         Xóa các điểm đỉnh/đáy cũ theo 2 tiêu chí:
@@ -204,44 +800,9 @@ class ChannelDetector:
         """
         removed_ids = []
         
-        # ===== XỬ LÝ DANH SÁCH ĐỈNH =====
-        if len(self.peaks_list) > 0:
-            # Xóa theo số lượng
-            while len(self.peaks_list) > self.max_pivots:
-                removed = self.peaks_list.pop(0)  # Xóa điểm cũ nhất (đầu danh sách)
-                removed_ids.append(removed['id'])
-                print(f"  ✗ Xóa đỉnh #{removed['id']} (vượt quá {self.max_pivots} điểm)")
-            
-            # Xóa theo tuổi (nếu có max_age_ms)
-            if self.max_age_ms is not None:
-                latest_timestamp = self.peaks_list[-1]['timestamp']  # Timestamp mới nhất
-                cutoff_timestamp = latest_timestamp - self.max_age_ms
-                
-                # Lọc bỏ điểm quá cũ
-                old_peaks = [p for p in self.peaks_list if p['timestamp'] < cutoff_timestamp]
-                for old_peak in old_peaks:
-                    self.peaks_list.remove(old_peak)
-                    removed_ids.append(old_peak['id'])
-                    print(f"  ✗ Xóa đỉnh #{old_peak['id']} (quá cũ)")
-        
-        # ===== XỬ LÝ DANH SÁCH ĐÁY =====
-        if len(self.troughs_list) > 0:
-            # Xóa theo số lượng
-            while len(self.troughs_list) > self.max_pivots:
-                removed = self.troughs_list.pop(0)
-                removed_ids.append(removed['id'])
-                print(f"  ✗ Xóa đáy #{removed['id']} (vượt quá {self.max_pivots} điểm)")
-            
-            # Xóa theo tuổi
-            if self.max_age_ms is not None:
-                latest_timestamp = self.troughs_list[-1]['timestamp']
-                cutoff_timestamp = latest_timestamp - self.max_age_ms
-                
-                old_troughs = [t for t in self.troughs_list if t['timestamp'] < cutoff_timestamp]
-                for old_trough in old_troughs:
-                    self.troughs_list.remove(old_trough)
-                    removed_ids.append(old_trough['id'])
-                    print(f"  ✗ Xóa đáy #{old_trough['id']} (quá cũ)")
+        # ===== XỬ LÝ DANH SÁCH ĐỈNH / ĐÁY =====
+        self._trim_pivots(self.peaks_list, 'đỉnh', removed_ids)
+        self._trim_pivots(self.troughs_list, 'đáy', removed_ids)
         
         # Nếu có điểm bị xóa, xóa các đường/tổ hợp liên quan
         if len(removed_ids) > 0:
@@ -250,6 +811,35 @@ class ChannelDetector:
             self._cleanup_old_candles()
     
     
+    def _trim_pivots(self, pivots, name, removed_ids):
+        """
+        Xóa điểm cũ ở đầu 1 danh sách pivot (đỉnh hoặc đáy), ghi ID vào removed_ids
+        
+        - Số điểm thừa tính 1 lần, xóa bằng popleft (O(1) mỗi điểm)
+        - max_age_ms = None (trường hợp thường gặp) → bỏ qua hẳn phần lọc theo tuổi
+        """
+        # Xóa theo số lượng
+        excess = len(pivots) - self.max_pivots
+        for _ in range(excess):
+            removed = pivots.popleft()  # Xóa điểm cũ nhất (đầu danh sách)
+            removed_ids.append(removed.id)
+            if self.verbose:
+                print(f"  ✗ Xóa {name} #{removed.id} (vượt quá {self.max_pivots} điểm)")
+        
+        # Xóa theo tuổi (nếu có max_age_ms)
+        if self.max_age_ms is None or not pivots:
+            return
+        
+        cutoff_timestamp = pivots[-1].ts - self.max_age_ms  # Mốc từ timestamp mới nhất
+        
+        # Lọc bỏ điểm quá cũ (điểm xếp theo thời gian → luôn nằm ở đầu)
+        while pivots and pivots[0].ts < cutoff_timestamp:
+            old_pivot = pivots.popleft()
+            removed_ids.append(old_pivot.id)
+            if self.verbose:
+                print(f"  ✗ Xóa {name} #{old_pivot.id} (quá cũ)")
+    
+    
     def _cleanup_old_candles(self):
         """
         Xóa candles cũ để đồng bộ với pivots
@@ -263,40 +853,23 @@ class ChannelDetector:
         1. Tìm timestamp của pivot cũ nhất (trong cả peaks và troughs)
         2. Xóa tất cả candles có timestamp < pivot_oldest_timestamp
         """
-        if len(self.candles_list) == 0:
+        if self.candles.n == 0:
             return
         
-        # Tìm timestamp pivot cũ nhất
-        oldest_pivot_ts = None
-        
-        if len(self.peaks_list) > 0 and len(self.troughs_list) > 0:
-            oldest_pivot_ts = min(self.peaks_list[0]['timestamp'], self.troughs_list[0]['timestamp'])
-        elif len(self.peaks_list) > 0:
-            oldest_pivot_ts = self.peaks_list[0]['timestamp']
-        elif len(self.troughs_list) > 0:
-            oldest_pivot_ts = self.troughs_list[0]['timestamp']
-        
-        if oldest_pivot_ts is None:
+        # Tìm timestamp pivot cũ nhất (pivot xếp theo thời gian → nằm ở đầu mỗi danh sách)
+        peaks = self.peaks_list
+        troughs = self.troughs_list
+        if peaks and troughs:
+            oldest_pivot_ts = min(peaks[0].ts, troughs[0].ts)
+        elif peaks or troughs:
+            oldest_pivot_ts = (peaks or troughs)[0].ts
+        else:
             return
         
-        # Chuyển đổi timestamp để so sánh
-        def to_ms(ts):
-            if isinstance(ts, (int, float)):
-                return int(ts)
-            try:
-                import pandas as pd
-                return int(pd.to_datetime(ts).timestamp() * 1000)
-            except:
-                return 0
-        
-        oldest_pivot_ms = to_ms(oldest_pivot_ts)
+        # Xóa candles cũ hơn pivot cũ nhất: 1 lần tìm nhị phân + dịch mảng
+        removed_count = self.candles.drop_before(oldest_pivot_ts)
         
-        # Xóa candles cũ hơn pivot cũ nhất
-        initial_count = len(self.candles_list)
-        self.candles_list = [c for c in self.candles_list if to_ms(c['timestamp']) >= oldest_pivot_ms]
-        removed_count = initial_count - len(self.candles_list)
-        
-        if removed_count > 0:
+        if removed_count > 0 and self.verbose:
             print(f"  ✗ Xóa {removed_count} nến cũ (trước pivot cũ nhất)")
     
     
@@ -318,58 +891,57 @@ class ChannelDetector:
         
         INPUT:
         ------
-        point1, point2: dict
-            {
-                'id': 0,
-                'timestamp': 1700000000000,
-                'price': 95000,
-                'type': 'peak' hoặc 'trough'
-            }
+        point1, point2: Pivot
+            Pivot(id=0, ts=1700000000000, price=95000, is_peak=True)
         
         OUTPUT:
         -------
-        line: dict
-            {
-                'id': 'line_0_2',           # ID duy nhất = 'line_{id1}_{id2}'
-                'point1': {...},            # Điểm 1
-                'point2': {...},            # Điểm 2
-                'slope': 0.05,              # Độ dốc (a)
-                'intercept': 10000,         # Điểm cắt (b)
-                'type': 'upper'/'lower',    # Đường trên hay dưới
-                'point_ids': (0, 2)         # Tuple IDs của 2 điểm (để theo dõi)
-            }
+        line: Line
+            Line(id='line_0_2',             # ID duy nhất = 'line_{id1}_{id2}'
+                 point1_id=0, point2_id=2,  # IDs của 2 điểm (để theo dõi)
+                 ts1, ts2, price1, price2,  # Tọa độ 2 điểm
+                 slope=0.05,                # Độ dốc (a)
+                 intercept=10000,           # Điểm cắt (b)
+                 is_upper=True)             # Đường trên hay dưới
+        """
+        return self.create_line_scalar(point1.id, point1.ts, point1.price,
+                                       point2.id, point2.ts, point2.price, point1.is_peak)
+    
+    
+    def create_line_scalar(self, id1, x1, y1, id2, x2, y2, is_upper):
+        """
+        Như create_line nhưng nhận thẳng các giá trị số (không cần tạo Pivot)
+        
+        INPUT:
+        ------
+        id1, x1, y1: ID, timestamp (ms), giá của điểm 1
+        id2, x2, y2: ID, timestamp (ms), giá của điểm 2
+        is_upper: bool
+            True = đường nối 2 đỉnh, False = đường nối 2 đáy
+        
+        OUTPUT:
+        -------
+        line: Line hoặc None (2 điểm cùng timestamp)
         """
-        # Tính độ dốc (slope)
-        x1 = point1['timestamp']
-        y1 = point1['price']
-        x2 = point2['timestamp']
-        y2 = point2['price']
+        # Giá có thể là float32 (dữ liệu đã downcast) → tính đường bằng float64
+        # (slope * timestamp ~ 1e12 cần đủ độ chính xác)
+        y1 = float(y1)
+        y2 = float(y2)
         
         # Tránh chia cho 0 (2 điểm trùng timestamp - không nên xảy ra)
         if x2 == x1:
-            print(f"  ⚠ Cảnh báo: 2 điểm có cùng timestamp! Bỏ qua.")
+            if self.verbose:
+                print(f"  ⚠ Cảnh báo: 2 điểm có cùng timestamp! Bỏ qua.")
             return None
         
         slope = (y2 - y1) / (x2 - x1)
         intercept = y1 - slope * x1
         
-        # Xác định loại đường (upper hay lower)
-        line_type = 'upper' if point1['type'] == 'peak' else 'lower'
-        
         # Tạo ID duy nhất cho đường
-        line_id = f"line_{point1['id']}_{point2['id']}"
-        
-        line = {
-            'id': line_id,
-            'point1': point1,
-            'point2': point2,
-            'slope': slope,
-            'intercept': intercept,
-            'type': line_type,
-            'point_ids': (point1['id'], point2['id'])
-        }
+        line_id = f"line_{id1}_{id2}"
         
-        return line
+        # Loại đường (upper hay lower) theo loại điểm
+        return Line(line_id, id1, id2, x1, x2, y1, y2, slope, intercept, is_upper)
     
     
     def _generate_new_lines(self, new_pivot_id):
@@ -391,8 +963,9 @@ class ChannelDetector:
         ------
         1. Tìm pivot mới trong danh sách (peaks hoặc troughs)
         2. Lấy danh sách các pivot cũ cùng loại
-        3. Tạo đường kết hợp pivot mới với từng pivot cũ
-        4. Lưu vào created_line_pairs để tránh tạo lại
+        3. Tính độ dốc của tất cả đường 1 lần (NumPy), loại ngay đường quá dốc
+        4. Tạo đường kết hợp pivot mới với từng pivot cũ còn lại
+        5. Lưu vào created_line_pairs để tránh tạo lại
         """
         # Tìm pivot mới
         new_pivot = None
@@ -400,7 +973,7 @@ class ChannelDetector:
         
         # Tìm trong danh sách đỉnh
         for p in self.peaks_list:
-            if p['id'] == new_pivot_id:
+            if p.id == new_pivot_id:
                 new_pivot = p
                 pivot_list = self.peaks_list
                 break
@@ -408,7 +981,7 @@ class ChannelDetector:
         # Nếu không có trong đỉnh, tìm trong đáy
         if new_pivot is None:
             for t in self.troughs_list:
-                if t['id'] == new_pivot_id:
+                if t.id == new_pivot_id:
                     new_pivot = t
                     pivot_list = self.troughs_list
                     break
@@ -417,21 +990,48 @@ class ChannelDetector:
         if new_pivot is None:
             return
         
-        # Tạo đường với các pivot cũ cùng loại
-        new_lines = []
-        
+        # Các pivot cũ cùng loại chưa tạo đường với pivot mới
+        candidates = []
         for old_pivot in pivot_list:
             # Bỏ qua chính nó
-            if old_pivot['id'] == new_pivot_id:
+            if old_pivot.id == new_pivot_id:
                 continue
             
             # Tạo cặp ID có thứ tự (nhỏ, lớn) để kiểm tra
-            pair = tuple(sorted([old_pivot['id'], new_pivot['id']]))
+            pair = tuple(sorted([old_pivot.id, new_pivot.id]))
             
             # Kiểm tra đã tạo chưa
             if pair in self.created_line_pairs:
                 continue  # Đã tạo rồi, bỏ qua
             
+            candidates.append((old_pivot, pair))
+        
+        if len(candidates) == 0:
+            return
+        
+        # Độ dốc của tất cả đường (pivot cũ → pivot mới) tính 1 lần,
+        # đường quá dốc bị loại trước khi tạo object Line
+        too_steep = None
+        if self.max_slope is not None:
+            old_ts = np.array([c[0].ts for c in candidates], dtype=np.float64)
+            old_price = np.array([c[0].price for c in candidates], dtype=np.float64)
+            dt = new_pivot.ts - old_ts
+            with np.errstate(divide='ignore', invalid='ignore'):
+                slopes = (new_pivot.price - old_price) / dt
+            # dt = 0 để create_line cảnh báo như cũ
+            too_steep = (self._geometry_codes(slopes, np.abs(dt)) == REASON_SLOPE) & (dt != 0)
+        
+        # Tạo đường với các pivot cũ cùng loại
+        new_lines = []
+        
+        for i, (old_pivot, pair) in enumerate(candidates):
+            if too_steep is not None and too_steep[i]:
+                list_name = 'trên' if new_pivot.is_peak else 'dưới'
+                if self.verbose:
+                    print(f"    ✗ Loại đường {list_name} line_{old_pivot.id}_{new_pivot.id}: "
+                          f"{self._reason_text(REASON_SLOPE, slope=slopes[i])}")
+                continue
+            
             # Tạo đường mới
             line = self.create_line(old_pivot, new_pivot)
             
@@ -439,19 +1039,20 @@ class ChannelDetector:
                 new_lines.append(line)
                 # Đánh dấu đã tạo
                 self.created_line_pairs.add(pair)
-                print(f"    ✓ Tạo đường {line['type']}: {line['id']} "
-                      f"(độ dốc={line['slope']:.6f})")
+                if self.verbose:
+                    print(f"    ✓ Tạo đường {line.type}: {line.id} "
+                          f"(độ dốc={line.slope:.6f})")
         
         # Phân loại và lưu vào danh sách tương ứng
         for line in new_lines:
-            if line['type'] == 'upper':
+            if line.is_upper:
                 self.upper_lines.append(line)
             else:
                 self.lower_lines.append(line)
         
         # Validate tất cả đường sau khi thêm mới (PHẦN 3)
         if len(new_lines) > 0:
-            self._update_valid_lines()
+            self._update_valid_lines(new_lines)
     
     
     def _cleanup_old_lines(self, removed_pivot_ids):
@@ -472,29 +1073,29 @@ class ChannelDetector:
         # Chuyển thành set để kiểm tra nhanh
         removed_ids_set = set(removed_pivot_ids)
         
-        # Xóa các đường trên
-        lines_to_remove = []
-        for line in self.upper_lines:
-            # Kiểm tra nếu đường chứa pivot đã bị xóa
-            if line['point1']['id'] in removed_ids_set or line['point2']['id'] in removed_ids_set:
-                lines_to_remove.append(line)
-        
-        for line in lines_to_remove:
-            self.upper_lines.remove(line)
-            # Xóa khỏi created_line_pairs
-            self.created_line_pairs.discard(line['point_ids'])
-            print(f"    ✗ Xóa đường trên: {line['id']}")
+        # Xóa các đường trên: đường bị xóa nếu point_ids có chung ID với removed_ids_set
+        # (isdisjoint chạy ở tầng C, không cần tra từng ID)
+        removed_lines = [line for line in self.upper_lines
+                         if not removed_ids_set.isdisjoint(line.point_ids)]
+        if removed_lines:
+            self.upper_lines = [line for line in self.upper_lines
+                                if removed_ids_set.isdisjoint(line.point_ids)]
+            for line in removed_lines:
+                # Xóa khỏi created_line_pairs
+                self.created_line_pairs.discard(line.point_ids)
+                if self.verbose:
+                    print(f"    ✗ Xóa đường trên: {line.id}")
         
         # Xóa các đường dưới
-        lines_to_remove = []
-        for line in self.lower_lines:
-            if line['point1']['id'] in removed_ids_set or line['point2']['id'] in removed_ids_set:
-                lines_to_remove.append(line)
-        
-        for line in lines_to_remove:
-            self.lower_lines.remove(line)
-            self.created_line_pairs.discard(line['point_ids'])
-            print(f"    ✗ Xóa đường dưới: {line['id']}")
+        removed_lines = [line for line in self.lower_lines
+                         if not removed_ids_set.isdisjoint(line.point_ids)]
+        if removed_lines:
+            self.lower_lines = [line for line in self.lower_lines
+                                if removed_ids_set.isdisjoint(line.point_ids)]
+            for line in removed_lines:
+                self.created_line_pairs.discard(line.point_ids)
+                if self.verbose:
+                    print(f"    ✗ Xóa đường dưới: {line.id}")
     
     
     # ========================================
@@ -521,7 +1122,7 @@ class ChannelDetector:
         
         INPUT:
         ------
-        line: dict
+        line: Line
             Đường cần kiểm tra (từ create_line)
         
         OUTPUT:
@@ -530,178 +1131,235 @@ class ChannelDetector:
             True = Hợp lệ, False = Không hợp lệ
         reason: str
             Lý do nếu không hợp lệ (dùng để debug)
-        """
-        # ===== KIỂM TRA 1: ĐỘ DỐC =====
-        if self.max_slope is not None:
-            if abs(line['slope']) > self.max_slope:
-                reason = f"Độ dốc quá lớn: |{line['slope']:.6f}| > {self.max_slope}"
-                return False, reason
         
-        # ===== KIỂM TRA 2: KHOẢNG CÁCH GIỮA 2 ĐIỂM =====
-        timestamp1 = line['point1']['timestamp']
-        timestamp2 = line['point2']['timestamp']
-        time_distance_ms = abs(timestamp2 - timestamp1)
+        LƯU Ý: cùng đường đi với validate_lines (1 đường) → chỉ có 1 bản cài đặt
+        của các tiêu chí
+        """
+        return self.validate_lines([line])[0]
+    
+    
+    def _reason_text(self, code, slope=0.0, distance_ms=0, pen_count=0, pen_max_pct=0.0):
+        """
+        Đổi mã lý do (REASON_*) thành chuỗi lý do loại đường
         
-        # Ước lượng số nến giữa 2 điểm
-        num_candles = time_distance_ms / self.candle_interval_ms
+        Nơi duy nhất tạo chuỗi lý do (validate, loại sớm đường quá dốc, script mô phỏng).
+        Chỉ cần truyền giá trị của tiêu chí tương ứng với code
+        (slope / distance_ms / pen_count / pen_max_pct)
+        """
+        if code == REASON_SLOPE:
+            return f"Độ dốc quá lớn: |{slope:.6f}| > {self.max_slope}"
+        if code == REASON_DISTANCE:
+            # Ước lượng số nến giữa 2 điểm (chỉ cần cho thông báo)
+            num_candles = distance_ms * self._inv_candle_interval_ms
+            return f"2 điểm quá gần: {num_candles:.1f} nến < {self.min_distance_candles}"
+        if code == REASON_PEN_COUNT:
+            # Kernel dừng đếm sớm khi đã vượt ngưỡng → số đếm chỉ là cận dưới
+            return f"Quá nhiều nến phá: ít nhất {pen_count} > {self.max_penetrating_candles}"
+        if code == REASON_PEN_PCT:
+            return f"Nến phá quá mạnh: {pen_max_pct:.2f}% > {self.max_penetration_pct}%"
+        return "OK"
+    
+    
+    def validate_lines(self, lines):
+        """
+        Validate nhiều đường 1 lần (cùng tiêu chí và lý do như validate_single_line)
         
-        if num_candles < self.min_distance_candles:
-            reason = f"2 điểm quá gần: {num_candles:.1f} nến < {self.min_distance_candles}"
-            return False, reason
+        XỬ LÝ:
+        ------
+        1. Độ dốc + khoảng cách tính bằng mảng NumPy cho tất cả đường
+        2. Chỉ các đường qua được bước 1 mới kiểm tra penetration,
+           gom thành 1 lần gọi kernel (_check_penetration_batch)
         
-        # ===== KIỂM TRA 3: PENETRATION ANALYSIS =====
-        is_valid, reason = self._check_line_penetration(line)
-        if not is_valid:
-            return False, reason
+        INPUT:
+        ------
+        lines: list[Line]
         
-        # ===== TẤT CẢ ĐIỀU KIỆN ĐỀU OK =====
-        return True, "OK"
+        RETURN:
+        -------
+        list[(is_valid, reason)] theo đúng thứ tự lines
+        """
+        m = len(lines)
+        results = [(True, "OK")] * m
+        if m == 0:
+            return results
+        
+        # ===== KIỂM TRA 1+2: ĐỘ DỐC + KHOẢNG CÁCH (vector hóa) =====
+        slopes = np.fromiter((line.slope for line in lines), dtype=np.float64, count=m)
+        distances = np.fromiter((abs(line.ts2 - line.ts1) for line in lines),
+                                dtype=np.float64, count=m)
+        codes = self._geometry_codes(slopes, distances)
+        rejected = codes != REASON_OK
+        
+        # Lý do loại (chỉ tạo chuỗi cho đường bị loại)
+        for j in np.flatnonzero(rejected):
+            results[j] = (False, self._reason_text(
+                int(codes[j]), slope=slopes[j], distance_ms=distances[j]))
+        
+        # ===== KIỂM TRA 3: PENETRATION (gom 1 lần) =====
+        passed = np.flatnonzero(~rejected)
+        to_scan = [lines[j] for j in passed]
+        if self.candles.n == 0:
+            return results
+        self._check_penetration_batch(to_scan)
+        for j, line in zip(passed, to_scan):
+            results[j] = self._penetration_verdict(line)
+        
+        return results
     
     
-    def _check_line_penetration(self, line):
+    def _geometry_codes(self, slopes, distances_ms):
         """
-        Kiểm tra các nến có phá qua đường không
+        Mã lý do theo độ dốc và khoảng cách giữa 2 điểm (tiêu chí 1+2 của validate_single_line)
         
-        MỤC ĐÍCH:
-        ---------
-        Phân tích các nến nằm giữa 2 pivot tạo đường để xem có nến nào
-        phá qua đường không. Đếm số nến phá và mức độ phá của từng nến.
+        Chỉ phụ thuộc vào đường, không phụ thuộc nến → không đổi theo thời gian.
+        Nhận mảng (hoặc số) → mảng mã: REASON_SLOPE (kiểm tra trước),
+        REASON_DISTANCE hoặc REASON_OK
+        """
+        codes = np.where(np.asarray(distances_ms) < self._min_distance_ms,
+                         REASON_DISTANCE, REASON_OK)
+        if self.max_slope is not None:
+            codes = np.where(np.abs(slopes) > self.max_slope, REASON_SLOPE, codes)
+        return codes
+    
+    
+    def _check_penetration_batch(self, lines):
+        """
+        Cập nhật cache penetration cho nhiều đường với 1 lần gọi kernel
         
-        TIÊU CHÍ LOẠI:
-        --------------
-        1. Có > max_penetrating_candles nến phá qua
-        2. Có bất kỳ nến nào phá > max_penetration_pct %
+        Mỗi đường chỉ quét các nến chưa kiểm tra (min(ts1, ts2) và validated_until
+        < ts < max(ts1, ts2)) rồi cộng dồn vào cache (pen_count, pen_max_pct).
+        Tất cả đường gom thành mảng (độ dốc, điểm cắt, khoảng thời gian) → vòng lặp
+        qua các đường chạy trong code đã biên dịch thay vì gọi Python từng đường.
+        Kết quả đọc bằng _penetration_verdict(line).
+        """
+        candles = self.candles
+        m = len(lines)
+        if candles.n == 0 or m == 0:
+            return
         
-        INPUT:
-        ------
-        line: dict
-            Đường cần kiểm tra
-            
-        OUTPUT:
-        -------
-        valid: bool
-            True = Không có penetration vượt ngưỡng
-            False = Có penetration vượt ngưỡng
-        reason: str
-            Lý do nếu không hợp lệ
-        """
-        if len(self.candles_list) == 0:
-            return True, "OK"
-        
-        # Chuyển đổi timestamp
-        def to_ms(ts):
-            if isinstance(ts, (int, float)):
-                return int(ts)
-            try:
-                import pandas as pd
-                return int(pd.to_datetime(ts).timestamp() * 1000)
-            except:
-                return 0
-        
-        # Lấy khoảng thời gian của đường
-        ts1 = line['point1']['timestamp']
-        ts2 = line['point2']['timestamp']
-        start_ts = min(ts1, ts2)
-        end_ts = max(ts1, ts2)
-        
-        # Lọc các nến nằm giữa 2 pivot (không bao gồm 2 pivot)
-        candles_between = []
-        for candle in self.candles_list:
-            candle_ts = to_ms(candle['timestamp'])
-            if start_ts < candle_ts < end_ts:
-                candles_between.append(candle)
-        
-        # Nếu không có nến giữa 2 pivot, OK
-        if len(candles_between) == 0:
-            return True, "OK"
-        
-        # Xác định loại đường (upper/lower)
-        line_type = line['type']  # 'upper' hoặc 'lower'
-        
-        # Đếm số nến phá và mức độ phá
-        penetrating_candles = []
-        
-        for candle in candles_between:
-            candle_ts = to_ms(candle['timestamp'])
-            
-            # Tính giá của đường tại thời điểm nến này
-            # line_price = slope * timestamp + intercept
-            line_price = line['slope'] * candle_ts + line['intercept']
-            
-            # Kiểm tra penetration
-            if line_type == 'upper':
-                # Đường trên: kiểm tra high có vượt qua đường không
-                if candle['high'] > line_price:
-                    penetration_pct = ((candle['high'] - line_price) / line_price) * 100
-                    penetrating_candles.append({
-                        'timestamp': candle['timestamp'],
-                        'penetration_pct': penetration_pct
-                    })
-            else:  # lower
-                # Đường dưới: kiểm tra low có thủng xuống dưới đường không
-                if candle['low'] < line_price:
-                    penetration_pct = ((line_price - candle['low']) / line_price) * 100
-                    penetrating_candles.append({
-                        'timestamp': candle['timestamp'],
-                        'penetration_pct': penetration_pct
-                    })
+        scan_from = np.empty(m, dtype=np.float64)
+        end_ts = np.empty(m, dtype=np.float64)
+        slopes = np.empty(m, dtype=np.float64)
+        intercepts = np.empty(m, dtype=np.float64)
+        is_upper = np.empty(m, dtype=np.bool_)
+        max_counts = np.empty(m, dtype=np.int64)
+        for j, line in enumerate(lines):
+            scan_from[j] = max(min(line.ts1, line.ts2), line.validated_until)
+            end_ts[j] = max(line.ts1, line.ts2)
+            slopes[j] = line.slope
+            intercepts[j] = line.intercept
+            is_upper[j] = line.is_upper
+            max_counts[j] = self.max_penetrating_candles - line.pen_count
+        
+        # Nhiều đường (vd. validate cả loạt trong script) → chia cho nhiều luồng
+        args = (candles.ts, candles.h, candles.l, candles.hmax, candles.lmin, candles.head,
+                candles.n, scan_from, end_ts, slopes, intercepts, is_upper, max_counts)
+        # Chỉ gọi bản parallel=True từ luồng chính: threading layer mặc định của
+        # numba (workqueue) không hỗ trợ gọi từ luồng khác (treo khi thoát chương trình).
+        # Luồng phụ dùng bản tuần tự (nogil → vẫn chạy song song với luồng khác)
+        if (NUMBA_AVAILABLE and m >= _PARALLEL_MIN_LINES
+                and threading.current_thread() is threading.main_thread()):
+            counts, max_pcts = _penetration_batch_parallel(*args)
+        else:
+            counts, max_pcts = _penetration_batch(*args)
+        
+        last_ts = int(candles.ts[candles.n - 1])
+        for j, line in enumerate(lines):
+            line.pen_count += int(counts[j])
+            line.pen_max_pct = max(line.pen_max_pct, float(max_pcts[j]))
+            line.validated_until = last_ts
+    
+    
+    def _penetration_verdict(self, line):
+        """
+        Kết luận penetration từ cache của đường (pen_count, pen_max_pct)
+        """
+        num_penetrating = line.pen_count
+        max_pct = line.pen_max_pct
         
         # Kiểm tra tiêu chí 1: Số nến phá
-        if len(penetrating_candles) > self.max_penetrating_candles:
-            reason = f"Quá nhiều nến phá: {len(penetrating_candles)} > {self.max_penetrating_candles}"
-            return False, reason
+        if num_penetrating > self.max_penetrating_candles:
+            return False, self._reason_text(REASON_PEN_COUNT, pen_count=num_penetrating)
         
         # Kiểm tra tiêu chí 2: Mức độ phá
-        for pen in penetrating_candles:
-            if pen['penetration_pct'] > self.max_penetration_pct:
-                reason = f"Nến phá quá mạnh: {pen['penetration_pct']:.2f}% > {self.max_penetration_pct}%"
-                return False, reason
+        if max_pct > self.max_penetration_pct:
+            return False, self._reason_text(REASON_PEN_PCT, pen_max_pct=max_pct)
         
         return True, "OK"
     
     
-    def _update_valid_lines(self):
+    def _update_valid_lines(self, new_lines):
         """
-        Lọc và cập nhật danh sách đường hợp lệ
+        Lọc và cập nhật danh sách đường hợp lệ (validate tăng dần)
         
         MỤC ĐÍCH:
         ---------
-        Sau khi tạo đường mới hoặc xóa đường cũ, cần validate lại
-        để đảm bảo chỉ giữ các đường hợp lệ trong upper_lines và lower_lines
+        Sau khi tạo đường mới, cần validate để đảm bảo chỉ giữ các đường
+        hợp lệ trong upper_lines và lower_lines
         
-        XỬ LÝ:
+        NGUYÊN TẮC:
+        -----------
+        - Đường MỚI: luôn kiểm tra đầy đủ
+        - Đường CŨ: độ dốc/khoảng cách không đổi, chỉ penetration có thể đổi
+          khi có nến mới rơi vào giữa 2 pivot của nó → chỉ kiểm tra lại đường
+          có nến mới kể từ lần validate trước (line.validated_until),
+          và chỉ quét phần nến mới đó (xem _check_penetration_batch)
+        - Xóa nến cũ không làm đường hợp lệ thành không hợp lệ → không cần kiểm tra lại
+        
+        INPUT:
         ------
-        1. Duyệt qua upper_lines, kiểm tra từng đường
-        2. Giữ lại đường hợp lệ, xóa đường không hợp lệ
-        3. Tương tự với lower_lines
+        new_lines: list
+            Các đường vừa tạo (đã nằm trong upper_lines/lower_lines)
         
         LƯU Ý:
         ------
         Hàm này được gọi tự động từ _generate_new_lines
         """
+        candles = self.candles
+        last_ts = int(candles.ts[candles.n - 1]) if candles.n > 0 else float('-inf')
+        new_line_ids = {line.id for line in new_lines}
+        
+        def needs_check(line):
+            if line.id in new_line_ids:
+                return True
+            # Có nến mới (ts > validated_until) nằm trước pivot cuối của đường?
+            checked_ts = line.validated_until
+            end_ts = max(line.ts1, line.ts2)
+            return last_ts > checked_ts and checked_ts < end_ts
+        
+        # ===== VALIDATE CÁC ĐƯỜNG CẦN KIỂM TRA =====
+        # Độ dốc/khoảng cách trước (rẻ), penetration cho các đường còn lại gom 1 lần
+        to_check = [line for line in self.upper_lines + self.lower_lines if needs_check(line)]
+        reasons = {}      # line.id -> lý do loại
+        for line, (is_valid, reason) in zip(to_check, self.validate_lines(to_check)):
+            if not is_valid:
+                reasons[line.id] = reason
+        
         # ===== LỌC ĐƯỜNG TRÊN =====
         valid_upper = []
         for line in self.upper_lines:
-            is_valid, reason = self.validate_single_line(line)
-            if is_valid:
+            reason = reasons.get(line.id)
+            if reason is None:
                 valid_upper.append(line)
             else:
-                print(f"    ✗ Loại đường trên {line['id']}: {reason}")
+                if self.verbose:
+                    print(f"    ✗ Loại đường trên {line.id}: {reason}")
                 # Xóa khỏi created_line_pairs
-                self.created_line_pairs.discard(line['point_ids'])
+                self.created_line_pairs.discard(line.point_ids)
         
         self.upper_lines = valid_upper
         
         # ===== LỌC ĐƯỜNG DƯỚI =====
         valid_lower = []
         for line in self.lower_lines:
-            is_valid, reason = self.validate_single_line(line)
-            if is_valid:
+            reason = reasons.get(line.id)
+            if reason is None:
                 valid_lower.append(line)
             else:
-                print(f"    ✗ Loại đường dưới {line['id']}: {reason}")
+                if self.verbose:
+                    print(f"    ✗ Loại đường dưới {line.id}: {reason}")
                 # Xóa khỏi created_line_pairs
-                self.created_line_pairs.discard(line['point_ids'])
+                self.created_line_pairs.discard(line.point_ids)
         
         self.lower_lines = valid_lower
     
@@ -714,9 +1372,9 @@ class ChannelDetector:
         ---------
         Xóa toàn bộ dữ liệu đã lưu, bắt đầu lại từ đầu
         """
-        self.peaks_list = []
-        self.troughs_list = []
-        self.candles_list = []
+        self.peaks_list = deque()
+        self.troughs_list = deque()
+        self.candles.clear()
         self.upper_lines = []
         self.lower_lines = []
         self.valid_combinations = []
@@ -724,7 +1382,8 @@ class ChannelDetector:
         self.created_combinations = set()
         self._next_pivot_id = 0
         
-        print("✓ Đã reset toàn bộ trạng thái ChannelDetector")
+        if self.verbose:
+            print("✓ Đã reset toàn bộ trạng thái ChannelDetector")
     
     
     def get_state(self):
@@ -738,13 +1397,13 @@ class ChannelDetector:
         return {
             'num_peaks': len(self.peaks_list),
             'num_troughs': len(self.troughs_list),
-            'num_candles': len(self.candles_list),
+            'num_candles': len(self.candles),
             'num_upper_lines': len(self.upper_lines),
             'num_lower_lines': len(self.lower_lines),
             'num_combinations': len(self.valid_combinations),
             'next_pivot_id': self._next_pivot_id,
-            'peaks_ids': [p['id'] for p in self.peaks_list],
-            'troughs_ids': [t['id'] for t in self.troughs_list]
+            'peaks_ids': [p.id for p in self.peaks_list],
+            'troughs_ids': [t.id for t in self.troughs_list]
         }
 
 
@@ -766,7 +1425,8 @@ if __name__ == "__main__":
         max_slope=0.0005,           # Giới hạn độ dốc
         min_distance_candles=2,      # 2 điểm phải cách nhau ít nhất 2 nến
         max_penetration_pct=0.3,    # 0.3% phá tối đa
-        max_penetrating_candles=2   # Tối đa 2 nến phá
+        max_penetrating_candles=2,  # Tối đa 2 nến phá
+        verbose=True                # In log chi tiết
     )
     
     print("\n" + "-" * 60)
@@ -863,21 +1523,21 @@ if __name__ == "__main__":
     if len(detector.upper_lines) > 0:
         print(f"\n  Chi tiết đường trên còn lại:")
         for line in detector.upper_lines:
-            print(f"    - {line['id']}: độ dốc={line['slope']:.8f}")
+            print(f"    - {line.id}: độ dốc={line.slope:.8f}")
     
     print("\n" + "-" * 60)
     print("TEST 4: Kiểm tra hàm validate trực tiếp")
     print("-" * 60)
     
     # Tạo đường test thủ công
-    point1 = {'id': 0, 'timestamp': base_timestamp, 'price': 95000, 'type': 'peak'}
-    point2 = {'id': 1, 'timestamp': base_timestamp + interval_ms * 5, 'price': 96000, 'type': 'peak'}
+    point1 = Pivot(0, base_timestamp, 95000, True)
+    point2 = Pivot(1, base_timestamp + interval_ms * 5, 96000, True)
     
     line_test = detector.create_line(point1, point2)
     is_valid, reason = detector.validate_single_line(line_test)
     
-    print(f"  Đường test: {line_test['id']}")
-    print(f"  Độ dốc: {line_test['slope']:.8f}")
+    print(f"  Đường test: {line_test.id}")
+    print(f"  Độ dốc: {line_test.slope:.8f}")
     print(f"  Khoảng cách: ~5 nến")
     print(f"  Kết quả: {'✓ HỢP LẼ' if is_valid else '✗ KHÔNG HỢP LỆ'}")
     print(f"  Lý do: {reason}")
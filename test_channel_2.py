@@ -30,15 +30,116 @@ VÍ DỤ FLOW (max_pivots=3):
 KẾT QUẢ VẼ: 1-2, 1-3, 2-3, 2-4, 3-4, 3-5, 4-5
 """
 
+import hashlib
+import importlib.util
+import os
+import weakref
+from collections import deque
+from functools import lru_cache
+
 import pandas as pd
 import plotly.graph_objects as go
 from datetime import datetime
 
+try:
+    from joblib import Memory
+    _memory = Memory(location='.cache', verbose=0)
+except ImportError:
+    # Không có joblib: không cache ra đĩa, lần chạy nào cũng tính lại
+    _memory = None
+
+try:
+    import pyarrow  # noqa: F401
+    # Có pyarrow: đọc CSV bằng engine pyarrow (đa luồng, nhanh hơn C engine)
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
+
+# Tham số validate của detector trong mô phỏng (cũng là 1 phần khóa cache)
+DETECTOR_PARAMS = dict(
+    max_age_ms=None,
+    max_slope=0.00003,
+    min_distance_candles=1,
+    max_penetration_pct=0.3,      # 0.3% phá tối đa
+    max_penetrating_candles=3,    # Tối đa 2 nến phá
+)
+
+
+def _disk_cache(func, ignore=None):
+    """Bọc func bằng joblib.Memory (cache ra thư mục .cache) nếu có joblib"""
+    if _memory is None:
+        return func
+    return _memory.cache(func, ignore=ignore)
+
+
+@lru_cache(maxsize=16)
+def _file_digest(path, mtime_ns, size):
+    """SHA-1 nội dung file (nhớ trong process theo path + thời gian sửa + kích thước)"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def csv_digest(csv_file):
+    """Hash của file CSV, dùng làm khóa cache (file đổi → hash đổi)"""
+    st = os.stat(csv_file)
+    return _file_digest(os.path.abspath(csv_file), st.st_mtime_ns, st.st_size)
+
+
+def frame_digest(df):
+    """Hash nội dung DataFrame (cả index), dùng làm khóa cache khi df truyền từ ngoài vào"""
+    values = pd.util.hash_pandas_object(df, index=True).values
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+def code_digest():
+    """
+    Hash của code tính pivot/đường và cách đọc CSV, dùng làm khóa cache
+    
+    joblib chỉ hash code của chính hàm được bọc → thêm hash của file này
+    (run_zigzag_full, simulate_sliding_window), channel_detector.py, new_zigzag
+    và CSV_DTYPES/CSV_ENGINE: đổi 1 trong số đó → tính lại thay vì dùng kết quả cũ
+    """
+    h = hashlib.sha1()
+    for name in ('channel_detector', 'new_zigzag'):
+        spec = importlib.util.find_spec(name)
+        if spec is not None and spec.origin:
+            h.update(csv_digest(spec.origin).encode())
+    h.update(csv_digest(__file__).encode())
+    h.update(repr((sorted(CSV_DTYPES.items()), CSV_ENGINE)).encode())
+    return h.hexdigest()
+
+
+# Kiểu dữ liệu khi đọc CSV: OHLCV dùng float32 (nửa bộ nhớ so với float64).
+# Sai số float32 ở giá ~100k là ~0.01, rất nhỏ so với ngưỡng phá 0.3%.
+# timestamp để engine tự nhận kiểu (số ms → int64/float64, ngày giờ → chuỗi);
+# riêng pyarrow đổi chuỗi ngày giờ thành datetime64 → load_csv_data đọc lại cột đó
+CSV_DTYPES = {
+    'open': 'float32',
+    'high': 'float32',
+    'low': 'float32',
+    'close': 'float32',
+    'volume': 'float32',
+}
+
 
 def load_csv_data(csv_file):
-    """Load dữ liệu từ CSV"""
+    """
+    Load dữ liệu từ CSV
+    
+    Dùng engine pyarrow nếu có (vẫn ra cột numpy float32 theo CSV_DTYPES,
+    không dùng dtype_backend='pyarrow' vì phía sau cần mảng numpy)
+    """
     print(f"\n📂 Load dữ liệu từ: {csv_file}")
-    df = pd.read_csv(csv_file)
+    df = pd.read_csv(csv_file, dtype=CSV_DTYPES, engine=CSV_ENGINE)
+    # pyarrow đã đổi chuỗi ngày giờ thành datetime64 → đọc lại cột dạng chuỗi
+    # để DataFrame giống C engine (số ms giữ nguyên kiểu engine đã nhận)
+    if pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        df['timestamp'] = pd.read_csv(csv_file, usecols=['timestamp'],
+                                      dtype={'timestamp': str}, engine=CSV_ENGINE)['timestamp']
     print(f"✓ Đã load {len(df)} nến")
     return df
 
@@ -57,17 +158,15 @@ def run_zigzag_full(df, H=1000, point=1.0):
     
     pivots = []
     
-    for idx, row in df.iterrows():
-        candle = {
-            'timestamp': row['timestamp'],
-            'open': row['open'],
-            'high': row['high'],
-            'low': row['low'],
-            'close': row['close'],
-            'volume': row['volume']
-        }
+    # Lấy các cột 1 lần dạng mảng (nhanh hơn iterrows rất nhiều: không tạo Series mỗi dòng)
+    cols = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+    arrays = [df[col].to_numpy() for col in cols]
+    process = new_zigzag.process_new_candle
+    
+    for values in zip(*arrays):
+        candle = dict(zip(cols, values))
         
-        result = new_zigzag.process_new_candle(candle, H=H, point=point)
+        result = process(candle, H=H, point=point)
         if result and result['pivot']:
             pivots.append(result['pivot'])
     
@@ -81,7 +180,7 @@ def run_zigzag_full(df, H=1000, point=1.0):
     return pivots
 
 
-def simulate_sliding_window(df, pivots, max_pivots=3, H=1000, point=1.0):
+def simulate_sliding_window(df, pivots, max_pivots=3, H=1000, point=1.0, detector_params=None):
     """
     Mô phỏng sliding window và tạo TẤT CẢ đường
     
@@ -90,6 +189,7 @@ def simulate_sliding_window(df, pivots, max_pivots=3, H=1000, point=1.0):
     - pivots: List tất cả pivot từ ZigZag
     - max_pivots: Giới hạn sliding window
     - H, point: Tham số để validate
+    - detector_params: Tham số còn lại của ChannelDetector (mặc định DETECTOR_PARAMS)
     
     OUTPUT:
     - all_upper_lines: List TẤT CẢ đường đỉnh-đỉnh
@@ -100,35 +200,22 @@ def simulate_sliding_window(df, pivots, max_pivots=3, H=1000, point=1.0):
     print(f"\n📐 Mô phỏng sliding window (max={max_pivots} pivot)...")
     
     # Khởi tạo detector
+    if detector_params is None:
+        detector_params = DETECTOR_PARAMS
     detector = channel_detector.ChannelDetector(
         max_pivots=max_pivots,
-        max_age_ms=None,
         H=H,
         point=point,
-        max_slope=0.00003,
-        min_distance_candles=1,
-        max_penetration_pct=0.3,      # 0.3% phá tối đa
-        max_penetrating_candles=3,    # Tối đa 2 nến phá
-        max_convergence=0.00002,    # Cho phép hội tụ thoáng
-        max_divergence=0.000015     # Cho phép phân kỳ ít
+        **detector_params
     )
     
-    # Sliding windows
-    peaks_window = []
-    troughs_window = []
+    # Sliding windows (deque tự bỏ phần tử cũ nhất khi append lúc đã đầy, O(1))
+    peaks_window = deque(maxlen=max_pivots)
+    troughs_window = deque(maxlen=max_pivots)
     
     # Feed tất cả candles vào detector trước
     print(f"  → Feed {len(df)} nến vào detector...")
-    for idx, row in df.iterrows():
-        candle = {
-            'timestamp': row['timestamp'],
-            'open': row['open'],
-            'high': row['high'],
-            'low': row['low'],
-            'close': row['close'],
-            'volume': row['volume']
-        }
-        detector.candles_list.append(candle)
+    detector.add_candles(df)
     
     # Lưu TẤT CẢ đường đã tạo
     all_upper_lines = []
@@ -138,41 +225,50 @@ def simulate_sliding_window(df, pivots, max_pivots=3, H=1000, point=1.0):
     created_peak_pairs = set()
     created_trough_pairs = set()
     
-    # Hàm chuyển timestamp
-    def to_ms(ts):
-        if isinstance(ts, (int, float)):
-            return int(ts)
-        try:
-            return int(pd.to_datetime(ts).timestamp() * 1000)
-        except:
-            return 0
+    # Chuyển timestamp của tất cả pivot sang ms 1 lần (vector hóa)
+    # thay vì parse lại từng chuỗi mỗi khi tạo đường
+    # (list theo vị trí pivot, không ghi thêm khóa vào dict pivot của caller)
+    pivots_ms = channel_detector._to_ms_array([p['timestamp'] for p in pivots]).tolist()
+    
+    # Đường chờ validate: validate gom 1 lần sau vòng lặp (detector.validate_lines)
+    pending = []      # [(dict vẽ, Line)]
     
-    # Hàm tạo đường từ 2 điểm
+    # Hàm tạo đường từ 2 điểm (chưa validate)
     def create_line_from_pivots(p1, p2, p1_idx, p2_idx):
-        point1 = {
-            'id': p1_idx,
-            'timestamp': to_ms(p1['timestamp']),
-            'price': p1['price'],
-            'type': p1['type']
-        }
-        point2 = {
-            'id': p2_idx,
-            'timestamp': to_ms(p2['timestamp']),
-            'price': p2['price'],
-            'type': p2['type']
-        }
+        ts1 = pivots_ms[p1_idx]
+        ts2 = pivots_ms[p2_idx]
         
-        line = detector.create_line(point1, point2)
-        is_valid, reason = detector.validate_single_line(line)
+        # Độ dốc tính trước (cùng công thức create_line_scalar): đường không qua
+        # được độ dốc/khoảng cách bị loại ngay, không tạo Line, không đưa vào validate
+        slope = (float(p2['price']) - float(p1['price'])) / (ts2 - ts1)
+        distance_ms = abs(ts2 - ts1)
+        code = int(detector._geometry_codes(slope, distance_ms))
         
-        line['is_valid'] = is_valid
-        line['reason'] = reason
-        line['timestamp1_str'] = p1['timestamp']
-        line['timestamp2_str'] = p2['timestamp']
-        line['pivot1_idx'] = p1_idx
-        line['pivot2_idx'] = p2_idx
+        # Thông tin để vẽ biểu đồ (is_valid/reason điền sau khi validate)
+        info = {
+            'slope': slope,
+            'price1': p1['price'],
+            'price2': p2['price'],
+            'is_valid': None,
+            'reason': None,
+            'timestamp1_str': p1['timestamp'],
+            'timestamp2_str': p2['timestamp'],
+            'pivot1_idx': p1_idx,
+            'pivot2_idx': p2_idx
+        }
+        if code != channel_detector.REASON_OK:
+            # Cùng kiểm tra và lý do với validate_lines
+            info['is_valid'] = False
+            info['reason'] = detector._reason_text(code, slope=slope, distance_ms=distance_ms)
+            return info
         
-        return line
+        line = detector.create_line_scalar(p1_idx, ts1, p1['price'],
+                                           p2_idx, ts2, p2['price'], p1['type'] == 'peak')
+        pending.append((info, line))
+        return info
+    
+    # Log in ra sau khi validate xong (đường in kèm trạng thái ✓/✗)
+    log = []
     
     # Xử lý từng pivot theo thứ tự
     pivot_counter = 0
@@ -183,17 +279,17 @@ def simulate_sliding_window(df, pivots, max_pivots=3, H=1000, point=1.0):
         if pivot_type == 'peak':
             # ===== XỬ LÝ ĐỈNH =====
             
-            print(f"\n  Đỉnh #{pivot_counter}: Price={pivot['price']:.2f}")
-            print(f"    Window trước: {[idx for idx, _ in peaks_window]}")
+            log.append(f"\n  Đỉnh #{pivot_counter}: Price={pivot['price']:.2f}")
+            log.append(f"    Window trước: {[idx for idx, _ in peaks_window]}")
             
-            # XÓA ĐIỂM CŨ TRƯỚC nếu window đã đầy
-            if len(peaks_window) >= max_pivots:
-                removed_idx, removed_pivot = peaks_window.pop(0)
-                print(f"    ✗ Xóa đỉnh #{removed_idx} (window đầy)")
+            # Window đã đầy → điểm cũ nhất sẽ bị deque bỏ khi append
+            if len(peaks_window) == max_pivots:
+                removed_idx, removed_pivot = peaks_window[0]
+                log.append(f"    ✗ Xóa đỉnh #{removed_idx} (window đầy)")
             
             # THÊM ĐIỂM MỚI vào window
             peaks_window.append((pivot_counter, pivot))
-            print(f"    Window sau: {[idx for idx, _ in peaks_window]}")
+            log.append(f"    Window sau: {[idx for idx, _ in peaks_window]}")
             
             # TẠO ĐƯỜNG với TẤT CẢ đỉnh khác trong window hiện tại
             current_idx = len(peaks_window) - 1
@@ -213,24 +309,22 @@ def simulate_sliding_window(df, pivots, max_pivots=3, H=1000, point=1.0):
                 line = create_line_from_pivots(p1, p2, idx1, idx2)
                 all_upper_lines.append(line)
                 
-                status = "✓" if line['is_valid'] else "✗"
-                reason_msg = f" ({line['reason']})" if not line['is_valid'] else ""
-                print(f"    → Tạo đường {idx1}-{idx2} {status}{reason_msg}")
+                log.append(line)
         
         else:
             # ===== XỬ LÝ ĐÁY =====
             
-            print(f"\n  Đáy #{pivot_counter}: Price={pivot['price']:.2f}")
-            print(f"    Window trước: {[idx for idx, _ in troughs_window]}")
+            log.append(f"\n  Đáy #{pivot_counter}: Price={pivot['price']:.2f}")
+            log.append(f"    Window trước: {[idx for idx, _ in troughs_window]}")
             
-            # XÓA ĐIỂM CŨ TRƯỚC nếu window đã đầy
-            if len(troughs_window) >= max_pivots:
-                removed_idx, removed_pivot = troughs_window.pop(0)
-                print(f"    ✗ Xóa đáy #{removed_idx} (window đầy)")
+            # Window đã đầy → điểm cũ nhất sẽ bị deque bỏ khi append
+            if len(troughs_window) == max_pivots:
+                removed_idx, removed_pivot = troughs_window[0]
+                log.append(f"    ✗ Xóa đáy #{removed_idx} (window đầy)")
             
             # THÊM ĐIỂM MỚI vào window
             troughs_window.append((pivot_counter, pivot))
-            print(f"    Window sau: {[idx for idx, _ in troughs_window]}")
+            log.append(f"    Window sau: {[idx for idx, _ in troughs_window]}")
             
             # TẠO ĐƯỜNG với TẤT CẢ đáy khác trong window hiện tại
             current_idx = len(troughs_window) - 1
@@ -250,12 +344,26 @@ def simulate_sliding_window(df, pivots, max_pivots=3, H=1000, point=1.0):
                 line = create_line_from_pivots(t1, t2, idx1, idx2)
                 all_lower_lines.append(line)
                 
-                status = "✓" if line['is_valid'] else "✗"
-                reason_msg = f" ({line['reason']})" if not line['is_valid'] else ""
-                print(f"    → Tạo đường {idx1}-{idx2} {status}{reason_msg}")
+                log.append(line)
         
         pivot_counter += 1
     
+    # ===== VALIDATE TẤT CẢ ĐƯỜNG 1 LẦN =====
+    # Gọi từ luồng chính với cả đỉnh lẫn đáy → đủ nhiều đường để detector
+    # dùng kernel song song (prange, chia đường cho tất cả nhân CPU)
+    results = detector.validate_lines([line for _, line in pending])
+    for (info, _), (is_valid, reason) in zip(pending, results):
+        info['is_valid'], info['reason'] = is_valid, reason
+    
+    for entry in log:
+        if isinstance(entry, str):
+            print(entry)
+        else:
+            status = "✓" if entry['is_valid'] else "✗"
+            reason_msg = f" ({entry['reason']})" if not entry['is_valid'] else ""
+            print(f"    → Tạo đường {entry['pivot1_idx']}-{entry['pivot2_idx']} "
+                  f"{status}{reason_msg}")
+    
     print(f"\n✓ Hoàn thành mô phỏng!")
     print(f"  - Tổng đường đỉnh: {len(all_upper_lines)}")
     print(f"    + Hợp lệ: {len([l for l in all_upper_lines if l['is_valid']])}")
@@ -267,15 +375,41 @@ def simulate_sliding_window(df, pivots, max_pivots=3, H=1000, point=1.0):
     return all_upper_lines, all_lower_lines
 
 
-def create_chart(df, pivots, upper_lines, lower_lines, title="ZigZag + Channel (Sliding Window)"):
+def _pivots_for(data_hash, code_hash, H, point, df):
+    """Pivot của dữ liệu (khóa cache: hash dữ liệu, hash code, H, point)"""
+    return run_zigzag_full(df, H=H, point=point)
+
+
+def _lines_for(data_hash, code_hash, H, point, max_pivots, detector_params, df, pivots):
+    """Đường của mô phỏng (khóa cache: hash dữ liệu, hash code, H, point, max_pivots, tham số detector)"""
+    return simulate_sliding_window(df, pivots, max_pivots, H, point, detector_params)
+
+
+# df/pivots không đưa vào khóa: đã được xác định bởi hash dữ liệu + hash code + tham số
+_pivots_for = _disk_cache(_pivots_for, ignore=['df'])
+_lines_for = _disk_cache(_lines_for, ignore=['df', 'pivots'])
+
+
+# Figure nền mẫu (nến + layout) của lần vẽ trước: {'df': weakref tới df, 'fig': fig}
+# (weakref → cache không giữ df sống; fig mẫu không bao giờ trả ra ngoài)
+_base_fig_cache = {}
+
+
+def build_base_fig(df):
     """
-    Tạo biểu đồ với TẤT CẢ đường
+    Tạo figure nền MỚI: trace nến + layout (không có pivot/đường)
+    
+    Giá không đổi giữa các lần vẽ với cùng df (vd. quét tham số) → figure mẫu
+    được nhớ lại theo đúng object df, lần sau chỉ sao chép figure mẫu
+    thay vì dựng lại trace nến. Mỗi lần gọi trả về 1 figure riêng.
     """
-    print(f"\n🎨 Tạo biểu đồ...")
+    ref = _base_fig_cache.get('df')
+    if ref is not None and ref() is df:
+        return go.Figure(_base_fig_cache['fig'])
     
     fig = go.Figure()
     
-    # 1. Vẽ nến
+    # Vẽ nến
     fig.add_trace(go.Candlestick(
         x=df['timestamp'],
         open=df['open'],
@@ -290,14 +424,48 @@ def create_chart(df, pivots, upper_lines, lower_lines, title="ZigZag + Channel (
         showlegend=False
     ))
     
-    # 2. Đánh dấu pivot
-    peaks = [p for p in pivots if p['type'] == 'peak']
-    troughs = [p for p in pivots if p['type'] == 'trough']
+    # Layout
+    fig.update_layout(
+        title={'x': 0.5, 'xanchor': 'center',
+               'font': {'size': 18, 'color': '#d1d4dc'}},
+        paper_bgcolor='#0d0e12',
+        plot_bgcolor='#0d0e12',
+        font={'color': '#d1d4dc'},
+        xaxis=dict(title='Time', gridcolor='#1e222d', linecolor='#2b2f3a',
+                  rangeslider=dict(visible=False)),
+        yaxis=dict(title='Price', gridcolor='#1e222d', linecolor='#2b2f3a',
+                  side='right'),
+        height=800,
+        legend=dict(x=0.01, y=0.99, bgcolor='rgba(13,14,18,0.9)',
+                   bordercolor='#2b2f3a', borderwidth=1),
+        hovermode='closest'
+    )
+    
+    _base_fig_cache['df'] = weakref.ref(df)
+    _base_fig_cache['fig'] = fig
+    return go.Figure(fig)
+
+
+def overlay_lines(fig, pivots, upper_lines, lower_lines, title):
+    """
+    Vẽ pivot + đường lên figure nền (thay toàn bộ trace cũ, giữ trace nến đầu tiên)
+    
+    pivots: DataFrame (cột timestamp, price, type) hoặc list pivot từ ZigZag
+    """
+    traces = []
+    
+    # 1. Đánh dấu pivot (lọc và lấy cột trên DataFrame, không duyệt từng dict)
+    if isinstance(pivots, pd.DataFrame):
+        pivots_df = pivots
+    else:
+        pivots_df = pd.DataFrame(pivots, columns=['timestamp', 'price', 'type'])
+    peaks = pivots_df[pivots_df['type'] == 'peak']
+    troughs = pivots_df[pivots_df['type'] == 'trough']
     
     if len(peaks) > 0:
-        fig.add_trace(go.Scatter(
-            x=[p['timestamp'] for p in peaks],
-            y=[p['price'] for p in peaks],
+        traces.append(go.Scatter(
+            x=peaks['timestamp'],
+            y=peaks['price'],
             mode='markers',
             name=f'Peaks ({len(peaks)})',
             marker=dict(symbol='triangle-down', size=10, color='#ff4444',
@@ -306,9 +474,9 @@ def create_chart(df, pivots, upper_lines, lower_lines, title="ZigZag + Channel (
         ))
     
     if len(troughs) > 0:
-        fig.add_trace(go.Scatter(
-            x=[t['timestamp'] for t in troughs],
-            y=[t['price'] for t in troughs],
+        traces.append(go.Scatter(
+            x=troughs['timestamp'],
+            y=troughs['price'],
             mode='markers',
             name=f'Troughs ({len(troughs)})',
             marker=dict(symbol='triangle-up', size=10, color='#44ff44',
@@ -316,97 +484,97 @@ def create_chart(df, pivots, upper_lines, lower_lines, title="ZigZag + Channel (
             showlegend=True
         ))
     
-    # 3. Vẽ đường đỉnh-đỉnh
-    for line in upper_lines:
-        x_coords = [line['timestamp1_str'], line['timestamp2_str']]
-        y_coords = [line['point1']['price'], line['point2']['price']]
+    # 2. Vẽ đường đỉnh-đỉnh và đáy-đáy
+    # Gộp tất cả đoạn cùng kiểu thành 1 trace (các đoạn ngăn bằng None)
+    # → tối đa 4 trace thay vì 1 trace mỗi đường
+    line_styles = [
+        # (danh sách, hợp lệ, tên, style, opacity)
+        (upper_lines, True, 'Upper', dict(color='#ff6b6b', width=2, dash='solid'), 0.7),
+        (upper_lines, False, 'Upper', dict(color='#ff9999', width=1.5, dash='dash'), 0.4),
+        (lower_lines, True, 'Lower', dict(color='#6bff6b', width=2, dash='solid'), 0.7),
+        (lower_lines, False, 'Lower', dict(color='#99ff99', width=1.5, dash='dash'), 0.4),
+    ]
+    
+    for lines, is_valid, name, line_style, opacity in line_styles:
+        x_coords = []
+        y_coords = []
+        hover_text = []
+        for line in lines:
+            if bool(line['is_valid']) != is_valid:
+                continue
+            text = (f"<b>{name} Line {line['pivot1_idx']}-{line['pivot2_idx']}</b><br>"
+                    f"Valid: {line['is_valid']}<br>"
+                    f"Slope: {line['slope']:.8f}")
+            x_coords += [line['timestamp1_str'], line['timestamp2_str'], None]
+            y_coords += [line['price1'], line['price2'], None]
+            hover_text += [text, text, None]
         
-        if line['is_valid']:
-            line_style = dict(color='#ff6b6b', width=2, dash='solid')
-            opacity = 0.7
-        else:
-            line_style = dict(color='#ff9999', width=1.5, dash='dash')
-            opacity = 0.4
+        if not x_coords:
+            continue
         
-        fig.add_trace(go.Scatter(
+        traces.append(go.Scatter(
             x=x_coords,
             y=y_coords,
             mode='lines',
             line=line_style,
             opacity=opacity,
-            name=f"Upper {line['pivot1_idx']}-{line['pivot2_idx']}",
+            name=f"{name} ({'valid' if is_valid else 'invalid'})",
             showlegend=False,
-            hovertemplate=f"<b>Upper Line {line['pivot1_idx']}-{line['pivot2_idx']}</b><br>" +
-                         f"Valid: {line['is_valid']}<br>" +
-                         f"Slope: {line['slope']:.8f}<extra></extra>"
+            text=hover_text,
+            hovertemplate="%{text}<extra></extra>"
         ))
     
-    # 4. Vẽ đường đáy-đáy
-    for line in lower_lines:
-        x_coords = [line['timestamp1_str'], line['timestamp2_str']]
-        y_coords = [line['point1']['price'], line['point2']['price']]
-        
-        if line['is_valid']:
-            line_style = dict(color='#6bff6b', width=2, dash='solid')
-            opacity = 0.7
-        else:
-            line_style = dict(color='#99ff99', width=1.5, dash='dash')
-            opacity = 0.4
-        
-        fig.add_trace(go.Scatter(
-            x=x_coords,
-            y=y_coords,
-            mode='lines',
-            line=line_style,
-            opacity=opacity,
-            name=f"Lower {line['pivot1_idx']}-{line['pivot2_idx']}",
-            showlegend=False,
-            hovertemplate=f"<b>Lower Line {line['pivot1_idx']}-{line['pivot2_idx']}</b><br>" +
-                         f"Valid: {line['is_valid']}<br>" +
-                         f"Slope: {line['slope']:.8f}<extra></extra>"
-        ))
+    # Cập nhật 1 lần: bỏ overlay cũ, thêm overlay mới, đổi tiêu đề
+    with fig.batch_update():
+        fig.data = fig.data[:1]
+        fig.add_traces(traces)
+        fig.layout.title.text = title
+    return fig
+
+
+def create_chart(df, pivots, upper_lines, lower_lines, title="ZigZag + Channel (Sliding Window)"):
+    """
+    Tạo biểu đồ với TẤT CẢ đường
     
-    # 5. Layout
-    fig.update_layout(
-        title={'text': title, 'x': 0.5, 'xanchor': 'center',
-               'font': {'size': 18, 'color': '#d1d4dc'}},
-        paper_bgcolor='#0d0e12',
-        plot_bgcolor='#0d0e12',
-        font={'color': '#d1d4dc'},
-        xaxis=dict(title='Time', gridcolor='#1e222d', linecolor='#2b2f3a',
-                  rangeslider=dict(visible=False)),
-        yaxis=dict(title='Price', gridcolor='#1e222d', linecolor='#2b2f3a',
-                  side='right'),
-        height=800,
-        legend=dict(x=0.01, y=0.99, bgcolor='rgba(13,14,18,0.9)',
-                   bordercolor='#2b2f3a', borderwidth=1),
-        hovermode='closest'
-    )
+    pivots: DataFrame (cột timestamp, price, type) hoặc list pivot từ ZigZag
+    
+    Trace nến + layout sao chép từ figure mẫu nếu đã vẽ với cùng df
+    (xem build_base_fig); figure trả về luôn là object mới
+    """
+    print(f"\n🎨 Tạo biểu đồ...")
+    
+    fig = build_base_fig(df)
+    overlay_lines(fig, pivots, upper_lines, lower_lines, title)
     
     print("✓ Đã tạo biểu đồ!")
     return fig
 
 
-def show_chart(fig):
-    """Hiển thị biểu đồ trong browser"""
-    import tempfile
+def show_chart(fig, out_path="out/chart.html"):
+    """
+    Hiển thị biểu đồ trong browser
+    
+    Ghi đè cùng 1 file mỗi lần chạy (không sinh file tạm mới).
+    plotly.min.js được ghi 1 lần cạnh file HTML (include_plotlyjs='directory')
+    → mở không cần mạng
+    """
     import webbrowser
     
     config = {'scrollZoom': True, 'displayModeBar': True,
              'displaylogo': False, 'responsive': True}
     
-    html = fig.to_html(config=config, include_plotlyjs='cdn')
+    out_dir = os.path.dirname(out_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
     
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.html', 
-                                    delete=False, encoding='utf-8') as f:
-        f.write(html)
-        temp_path = f.name
+    fig.write_html(out_path, config=config, include_plotlyjs='directory')
     
-    webbrowser.open('file://' + temp_path)
-    print(f"✓ Đã mở biểu đồ: {temp_path}")
+    abs_path = os.path.abspath(out_path)
+    webbrowser.open('file://' + abs_path)
+    print(f"✓ Đã mở biểu đồ: {abs_path}")
 
 
-def run_analysis(csv_file="data/BTCUSDT_15m.csv", max_pivots=3, H=1000, point=1.0):
+def run_analysis(csv_file="data/BTCUSDT_15m.csv", max_pivots=3, H=1000, point=1.0, df=None):
     """
     Chạy phân tích hoàn chỉnh
     
@@ -414,6 +582,10 @@ def run_analysis(csv_file="data/BTCUSDT_15m.csv", max_pivots=3, H=1000, point=1.
     - csv_file: File dữ liệu
     - max_pivots: Giới hạn sliding window
     - H, point: Tham số ZigZag
+    - df: DataFrame đã load (vd. df trả về từ lần chạy trước);
+      None → load từ csv_file. Dùng lại df khi quét tham số để không đọc lại CSV
+      và để figure nến lấy từ cache (build_base_fig). Khóa cache lấy theo
+      nội dung df (frame_digest), không theo csv_file
     
     OUTPUT:
     - df, pivots, upper_lines, lower_lines, fig
@@ -426,22 +598,29 @@ def run_analysis(csv_file="data/BTCUSDT_15m.csv", max_pivots=3, H=1000, point=1.
     print(f"   - ZigZag: H={H}, point={point}")
     print("="*70)
     
-    # 1. Load data
-    df = load_csv_data(csv_file)
+    # 1. Load data (khóa cache: hash file CSV, hoặc hash nội dung df nếu df truyền vào)
+    if df is None:
+        df = load_csv_data(csv_file)
+        data_hash = csv_digest(csv_file)
+    else:
+        data_hash = frame_digest(df)
     
-    # 2. Chạy ZigZag qua toàn bộ
-    pivots = run_zigzag_full(df, H=H, point=point)
+    # 2. Chạy ZigZag qua toàn bộ (lấy từ cache nếu đã chạy với cùng dữ liệu + tham số)
+    code_hash = code_digest()
+    pivots = _pivots_for(data_hash, code_hash, H, point, df)
     
     if len(pivots) < 2:
         print("\n⚠️  Không đủ pivot!")
         return None
     
     # 3. Mô phỏng sliding window
-    upper_lines, lower_lines = simulate_sliding_window(df, pivots, max_pivots, H, point)
+    upper_lines, lower_lines = _lines_for(data_hash, code_hash, H, point, max_pivots,
+                                          DETECTOR_PARAMS, df, pivots)
     
     # 4. Vẽ biểu đồ
     title = f"ZigZag + Channel (Window={max_pivots}, H={H})"
-    fig = create_chart(df, pivots, upper_lines, lower_lines, title)
+    pivots_df = pd.DataFrame(pivots)
+    fig = create_chart(df, pivots_df, upper_lines, lower_lines, title)
     
     # 5. Hiển thị
     show_chart(fig)
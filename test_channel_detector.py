@@ -0,0 +1,275 @@
+"""
+========================================
+TEST: CHANNEL DETECTOR
+========================================
+
+So sánh các đường chạy nhanh của channel_detector với bản tham chiếu đơn giản:
+- CandleBuffer (head, dồn mảng, bucket hmax/lmin) sau append/extend/drop_before/ensure
+- _penetration_kernel (numba, bỏ qua bucket) với _penetration_numpy
+- _penetration_batch_numpy (gom nhóm theo ngân sách ô) với từng đường riêng lẻ
+- Chuỗi add_pivot với cách tính brute-force các đường hợp lệ
+- _to_ms_array với _to_ms
+
+Chạy: python -m pytest test_channel_detector.py
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import channel_detector as cd
+
+
+CANDLE_MS = 15 * 60 * 1000
+
+
+def _random_ops_buffer(rng, num_ops=60):
+    """
+    Tạo CandleBuffer bằng chuỗi append/extend/drop_before/ensure ngẫu nhiên
+    
+    cap ban đầu nhỏ → có cả cấp phát lại lẫn dồn dữ liệu về đầu mảng.
+    Sau mỗi thao tác so với danh sách tham chiếu (_check_buffer)
+    
+    RETURN:
+    -------
+    (buf, ref): ref = {'ts', 'h', 'l'} là list các nến còn giữ
+    """
+    buf = cd.CandleBuffer(cap=8)
+    ref = {'ts': [], 'h': [], 'l': []}
+    next_ts = 1_700_000_000_000
+    price = 100.0
+    
+    def new_candles(k):
+        nonlocal next_ts, price
+        ts = next_ts + CANDLE_MS * np.arange(k, dtype=np.int64)
+        next_ts += CANDLE_MS * k
+        close = price + np.cumsum(rng.normal(0, 0.5, k))
+        price = float(close[-1])
+        h = close + rng.uniform(0, 0.5, k)
+        l = close - rng.uniform(0, 0.5, k)
+        return ts, h, l, close
+    
+    for _ in range(num_ops):
+        op = rng.integers(4)
+        if op == 0:
+            ts, h, l, c = new_candles(1)
+            buf.append(int(ts[0]), c[0], h[0], l[0], c[0], 1.0)
+        elif op == 1:
+            ts, h, l, c = new_candles(int(rng.integers(1, 40)))
+            buf.extend(ts, c, h, l, c, np.ones(len(ts)))
+        elif op == 2 and ref['ts']:
+            # Xóa đến 1 nến ngẫu nhiên (có thể xóa hết)
+            cut = ref['ts'][int(rng.integers(len(ref['ts'])))] + int(rng.integers(2)) * CANDLE_MS
+            buf.drop_before(cut)
+            keep = sum(t < cut for t in ref['ts'])
+            for key in ref:
+                del ref[key][:keep]
+            continue
+        else:
+            buf.ensure(buf.n + int(rng.integers(0, 80)))
+            continue
+        ref['ts'].extend(ts.tolist())
+        ref['h'].extend(h.tolist())
+        ref['l'].extend(l.tolist())
+        _check_buffer(buf, ref)
+    _check_buffer(buf, ref)
+    return buf, ref
+
+
+def _check_buffer(buf, ref):
+    """Dữ liệu khớp tham chiếu, bucket bao trọn high/low của các nến còn giữ"""
+    n = buf.n
+    assert n == len(ref['ts'])
+    np.testing.assert_array_equal(buf.ts[:n], ref['ts'])
+    np.testing.assert_array_equal(buf.h[:n], ref['h'])
+    np.testing.assert_array_equal(buf.l[:n], ref['l'])
+    for i in range(n):
+        b = (buf.head + i) // cd._BUCKET_SIZE
+        assert buf.hmax[b] >= buf.h[i]
+        assert buf.lmin[b] <= buf.l[i]
+
+
+def _random_lines(rng, buf, m):
+    """Đường ngẫu nhiên đi qua vùng giá của nến (để có cả đường bị phá lẫn không)"""
+    n = buf.n
+    i1 = rng.integers(0, n, m)
+    i2 = rng.integers(0, n, m)
+    i2 = np.where(i1 == i2, (i1 + 1) % n, i2)
+    is_upper = rng.random(m) < 0.5
+    ts1 = buf.ts[i1].astype(np.float64)
+    ts2 = buf.ts[i2].astype(np.float64)
+    p1 = np.where(is_upper, buf.h[i1], buf.l[i1]) + rng.normal(0, 0.5, m)
+    p2 = np.where(is_upper, buf.h[i2], buf.l[i2]) + rng.normal(0, 0.5, m)
+    slopes = (p2 - p1) / (ts2 - ts1)
+    intercepts = p1 - slopes * ts1
+    return np.minimum(ts1, ts2), np.maximum(ts1, ts2), slopes, intercepts, is_upper
+
+
+def _assert_same_penetration(count_a, pct_a, count_b, pct_b, max_count):
+    """
+    Cùng kết luận penetration: vượt max_count ở cả 2 bên (số đếm khi dừng sớm
+    chỉ là cận dưới), hoặc cùng số nến phá và cùng mức phá lớn nhất
+    """
+    if count_a > max_count or count_b > max_count:
+        assert count_a > max_count and count_b > max_count
+    else:
+        assert count_a == count_b
+        assert pct_a == pytest.approx(pct_b, rel=1e-9, abs=1e-9)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_candle_buffer_ops(seed):
+    _random_ops_buffer(np.random.default_rng(seed))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_penetration_kernel_matches_numpy(seed):
+    rng = np.random.default_rng(seed)
+    buf, _ = _random_ops_buffer(rng)
+    if buf.n < 2:
+        return
+    lo_ts, hi_ts, slopes, intercepts, is_upper = _random_lines(rng, buf, 200)
+    ts = buf.ts[:buf.n]
+    for j in range(len(slopes)):
+        s = int(np.searchsorted(ts, lo_ts[j], side='right'))
+        e = int(np.searchsorted(ts, hi_ts[j], side='left'))
+        max_count = int(rng.integers(0, 6))
+        args = (buf.ts, buf.h, buf.l, buf.hmax, buf.lmin, buf.head, s, e,
+                slopes[j], intercepts[j], bool(is_upper[j]), max_count)
+        count_k, pct_k = cd._penetration_kernel(*args)
+        count_n, pct_n = cd._penetration_numpy(*args)
+        _assert_same_penetration(count_k, pct_k, count_n, pct_n, max_count)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_penetration_batch_matches_single(seed, monkeypatch):
+    # Ngân sách nhỏ → nhiều nhóm, có cả đường dài hơn ngân sách (nhóm 1 đường)
+    monkeypatch.setattr(cd, '_BATCH_NUMPY_MAX_CELLS', 64)
+    rng = np.random.default_rng(seed)
+    buf, _ = _random_ops_buffer(rng)
+    if buf.n < 2:
+        return
+    m = 150
+    scan_from, end_ts, slopes, intercepts, is_upper = _random_lines(rng, buf, m)
+    max_counts = rng.integers(0, 6, m)
+    args = (buf.ts, buf.h, buf.l, buf.hmax, buf.lmin, buf.head, buf.n,
+            scan_from, end_ts, slopes, intercepts, is_upper, max_counts)
+    counts, max_pcts = cd._penetration_batch_numpy(*args)
+    
+    ts = buf.ts[:buf.n]
+    for j in range(m):
+        s = int(np.searchsorted(ts, scan_from[j], side='right'))
+        e = int(np.searchsorted(ts, end_ts[j], side='left'))
+        if e > s:
+            count, pct = cd._penetration_numpy(
+                buf.ts, buf.h, buf.l, buf.hmax, buf.lmin, buf.head, s, e,
+                slopes[j], intercepts[j], is_upper[j], max_counts[j])
+        else:
+            count, pct = 0, 0.0
+        assert counts[j] == count
+        assert max_pcts[j] == pytest.approx(pct, rel=1e-12, abs=1e-12)
+    
+    # Bản numba (tuần tự và song song) cùng kết luận với bản NumPy
+    for batch in (cd._penetration_batch_kernel, cd._penetration_batch_parallel):
+        counts_k, max_pcts_k = batch(*args)
+        for j in range(m):
+            _assert_same_penetration(counts_k[j], max_pcts_k[j], counts[j], max_pcts[j],
+                                     max_counts[j])
+
+
+def _brute_force_lines(detector, window, candles):
+    """
+    Id các đường hợp lệ của 1 loại pivot trong window, tính trực tiếp từ định nghĩa
+    
+    Nến giữa 2 pivot luôn đã có khi đường được tạo (pivot đến theo thời gian),
+    nến sau đó không rơi vào đường → hợp lệ hay không xác định 1 lần
+    """
+    valid = set()
+    for a in range(len(window)):
+        for b in range(a + 1, len(window)):
+            id1, ts1, price1, is_peak = window[a]
+            id2, ts2, price2, _ = window[b]
+            slope = (price2 - price1) / (ts2 - ts1)
+            intercept = price1 - slope * ts1
+            if abs(slope) > detector.max_slope:
+                continue
+            if ts2 - ts1 < detector.min_distance_candles * detector.candle_interval_ms:
+                continue
+            count = 0
+            max_pct = 0.0
+            for ts, high, low in candles:
+                if not ts1 < ts < ts2:
+                    continue
+                line_price = slope * ts + intercept
+                d = high - line_price if is_peak else line_price - low
+                if d > 0:
+                    count += 1
+                    max_pct = max(max_pct, d / line_price * 100)
+            if count > detector.max_penetrating_candles:
+                continue
+            if max_pct > detector.max_penetration_pct:
+                continue
+            valid.add(f"line_{id1}_{id2}")
+    return valid
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_add_pivot_stream_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    detector = cd.ChannelDetector(max_pivots=4, max_slope=2e-7, min_distance_candles=3,
+                                  max_penetration_pct=0.3, max_penetrating_candles=2)
+    candles = []
+    peaks = []
+    troughs = []
+    price = 100.0
+    ts = 1_700_000_000_000
+    next_pivot = 2
+    is_peak = True
+    seen_valid = 0
+    for i in range(400):
+        price += rng.normal(0, 0.3)
+        high = price + rng.uniform(0, 0.3)
+        low = price - rng.uniform(0, 0.3)
+        candle = {'timestamp': ts, 'open': price, 'high': high, 'low': low,
+                  'close': price, 'volume': 1.0}
+        candles.append((ts, high, low))
+        
+        pivot = None
+        if i == next_pivot:
+            pivot = {'timestamp': ts, 'price': high if is_peak else low,
+                     'type': 'peak' if is_peak else 'trough'}
+        pivot_id = detector.add_pivot({'candle': candle, 'pivot': pivot})
+        
+        if pivot is not None:
+            window = peaks if is_peak else troughs
+            window.append((pivot_id, ts, pivot['price'], is_peak))
+            del window[:-detector.max_pivots]
+            expected_upper = _brute_force_lines(detector, peaks, candles)
+            expected_lower = _brute_force_lines(detector, troughs, candles)
+            assert {line.id for line in detector.upper_lines} == expected_upper
+            assert {line.id for line in detector.lower_lines} == expected_lower
+            seen_valid += len(expected_upper) + len(expected_lower)
+            next_pivot = i + int(rng.integers(1, 8))
+            is_peak = not is_peak
+        ts += CANDLE_MS
+    # Có đường hợp lệ để so sánh (không phải trường hợp rỗng)
+    assert seen_valid > 0
+
+
+@pytest.mark.parametrize('values', [
+    [1_700_000_000_000, 1_700_000_900_000],
+    [1_700_000_000_000.0, 1_700_000_900_000.5],
+    np.array([1_700_000_000_000, 1_700_000_900_000], dtype=object),
+    ['2024-01-01 00:00:00', '2024-01-01 00:15:00'],
+    ['2024-01-01T00:00:00+07:00', '2024-01-01T00:15:00+07:00'],
+    ['2024-01-01 00:00:00', 'không phải ngày'],
+])
+def test_to_ms_array_matches_scalar(values):
+    expected = [cd._to_ms(v) for v in values]
+    result = cd._to_ms_array(values)
+    assert result.dtype == np.int64
+    assert result.tolist() == expected
+
+
+def test_to_ms_array_unparseable_is_zero():
+    assert cd._to_ms_array(pd.Series(['abc', 'xyz'], dtype=object).to_numpy()).tolist() == [0, 0]